@@ -0,0 +1,206 @@
+"""Benchmark template generation on synthetic Sierrafiles.
+
+Sierrafiles are synthesized for every combination of the number of services,
+the number of environment variables given to every service and whether the
+services have pipelines. Each phase of a generation is measured separately:
+
+- load: ``json.load`` of the Sierrafile
+- parse: ``sierra.config.parse``
+- build: ``sierra.template.build_template``
+- json, yaml: writing the template with ``sierra.output.dump``
+
+Wall times are the median of several runs. Peak memory is measured in a
+separate run with tracemalloc, since tracing slows everything down. The
+resource and parameter limits of a single stack are lifted, so that large
+Sierrafiles can be built into one template.
+"""
+
+import argparse
+import gc
+import io
+import itertools
+import json
+import os
+import statistics
+import sys
+import time
+import tracemalloc
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+import troposphere  # noqa: E402
+
+from sierra.config import parse  # noqa: E402
+from sierra.output import dump  # noqa: E402
+from sierra.template import build_template  # noqa: E402
+
+
+PHASES = ('load', 'parse', 'build', 'json', 'yaml')
+
+
+def synthesize(services, env_vars, pipeline):
+    """Return the text of a Sierrafile with the given number of things."""
+    environment = {}
+    for i in range(env_vars):
+        name = f'VARIABLE_{i}'
+        if i % 3 == 0:
+            environment[name] = None
+        elif i % 3 == 1:
+            environment[name] = f'http://{{ENDPOINT}}:{8000 + i}/'
+        else:
+            environment[name] = f'value-{i}'
+
+    sierrafile = {
+        'environment': environment,
+        'default': {
+            'container': {'cpu': 256, 'memory': 1024},
+            'pipeline': {'user': 'sierra', 'branch': 'master'},
+            'environment': list(environment),
+        },
+        'services': {},
+    }
+
+    for i in range(services):
+        service = {
+            'container': {
+                'image': f'sierra/service-{i}',
+                'port': 1024 + i,
+            },
+        }
+        if pipeline:
+            service['pipeline'] = {'repo': f'service-{i}'}
+        sierrafile['services'][f'Service{i}'] = service
+
+    return json.dumps(sierrafile)
+
+
+def run_phases(text, measure):
+    """Generate a template, measuring every phase with measure(phase, f)."""
+    raw = measure('load', lambda: json.load(io.StringIO(text)))
+    sierrafile = measure('parse', lambda: parse(raw))
+    template = measure('build', lambda: build_template(sierrafile))
+    measure('json', lambda: dump(template, io.StringIO(), 'json'))
+    measure('yaml', lambda: dump(template, io.StringIO(), 'yaml'))
+
+
+def benchmark(text, repeat):
+    times = {phase: [] for phase in PHASES}
+    peaks = {}
+
+    def timed(phase, f):
+        start = time.perf_counter()
+        result = f()
+        times[phase].append(time.perf_counter() - start)
+        return result
+
+    def traced(phase, f):
+        tracemalloc.start()
+        try:
+            result = f()
+            peaks[phase] = tracemalloc.get_traced_memory()[1]
+        finally:
+            tracemalloc.stop()
+        return result
+
+    for _ in range(repeat):
+        gc.collect()
+        run_phases(text, timed)
+
+    gc.collect()
+    run_phases(text, traced)
+
+    return {
+        phase: {
+            'min': min(times[phase]),
+            'median': statistics.median(times[phase]),
+            'peak_bytes': peaks[phase],
+        }
+        for phase in PHASES
+    }
+
+
+def compare(results, baseline, tolerance, min_time):
+    regressions = []
+    for scenario, phases in results.items():
+        for phase, stats in phases.items():
+            old = baseline.get(scenario, {}).get(phase)
+            if old is None:
+                continue
+
+            # Phases this short are mostly noise
+            limit = max(old['median'], min_time) * (1 + tolerance)
+            if stats['median'] > limit:
+                regressions.append(
+                    f'{scenario} {phase}: {stats["median"]:.4f}s >'
+                    f' {limit:.4f}s (baseline {old["median"]:.4f}s)')
+
+            limit = old['peak_bytes'] * (1 + tolerance)
+            if stats['peak_bytes'] > limit:
+                regressions.append(
+                    f'{scenario} {phase}: {stats["peak_bytes"]} bytes >'
+                    f' {limit:.0f} bytes (baseline {old["peak_bytes"]})')
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--services', type=int, nargs='+',
+                        default=[1, 10, 100, 500, 2000],
+                        help='numbers of services to benchmark')
+    parser.add_argument('--env-vars', type=int, nargs='+', default=[0, 10],
+                        help='numbers of environment variables per service')
+    parser.add_argument('--pipelines', choices=['on', 'off'], nargs='+',
+                        default=['off', 'on'],
+                        help='whether the services have pipelines')
+    parser.add_argument('-n', '--repeat', type=int, default=3,
+                        help='number of timed runs per Sierrafile')
+    parser.add_argument('-o', '--output', type=str,
+                        help='a file to write the results into')
+    parser.add_argument('--baseline', type=str,
+                        help='a previous results file to compare against')
+    parser.add_argument('--tolerance', type=float, default=0.25,
+                        help='allowed slowdown and memory growth relative'
+                             ' to the baseline')
+    parser.add_argument('--min-time', type=float, default=0.005,
+                        help='phases faster than this many seconds are'
+                             ' never reported as slower')
+
+    args = parser.parse_args()
+
+    troposphere.MAX_RESOURCES = sys.maxsize
+    troposphere.MAX_PARAMETERS = sys.maxsize
+
+    results = {}
+    scenarios = itertools.product(
+        args.services, args.env_vars, args.pipelines)
+
+    for services, env_vars, pipeline in scenarios:
+        scenario = f'services={services},env={env_vars},pipeline={pipeline}'
+        text = synthesize(services, env_vars, pipeline == 'on')
+        results[scenario] = stats = benchmark(text, args.repeat)
+
+        print(scenario)
+        for phase in PHASES:
+            print(f'  {phase:<6} median {stats[phase]["median"]:.4f}s'
+                  f'  min {stats[phase]["min"]:.4f}s'
+                  f'  peak {stats[phase]["peak_bytes"] / 2**20:.1f} MB')
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(results, f, indent=2, sort_keys=True)
+
+    failures = []
+    if args.baseline:
+        with open(args.baseline) as f:
+            failures = compare(
+                results, json.load(f), args.tolerance, args.min_time)
+
+    for failure in failures:
+        print('FAIL', failure, file=sys.stderr)
+
+    sys.exit(1 if failures else 0)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,153 @@
+"""Benchmark the startup time of the sierra command line interface.
+
+Each measurement runs in a fresh process so that nothing is shared between
+runs. Three things are measured:
+
+- import: the time it takes to import the ``sierra.__main__`` module
+- help: the time until ``sierra --help`` writes its first byte of output
+- generate: the time until a full template is written for a Sierrafile
+
+The script also checks that printing help does not import troposphere or
+awacs, which is what keeps the first two numbers small.
+"""
+
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+import time
+
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+EXAMPLE = os.path.join(ROOT, 'examples', 'Sierrafile.full')
+
+IMPORT_SNIPPET = (
+    'import time\n'
+    't = time.perf_counter()\n'
+    'import sierra.__main__\n'
+    'print(time.perf_counter() - t)\n'
+)
+
+LAZY_SNIPPET = (
+    'import sys\n'
+    'from sierra.__main__ import main\n'
+    'sys.argv = ["sierra", "--help"]\n'
+    'try:\n'
+    '    main()\n'
+    'except SystemExit:\n'
+    '    pass\n'
+    'heavy = sorted(m for m in sys.modules\n'
+    '               if m.split(".")[0] in ("troposphere", "awacs"))\n'
+    'print(",".join(heavy), file=sys.stderr)\n'
+)
+
+
+def time_import():
+    out = subprocess.check_output(
+        [sys.executable, '-c', IMPORT_SNIPPET], cwd=ROOT)
+    return float(out)
+
+
+def time_first_output(command):
+    start = time.perf_counter()
+    proc = subprocess.Popen(
+        command, cwd=ROOT, stdout=subprocess.PIPE, stderr=subprocess.DEVNULL)
+    proc.stdout.read(1)
+    elapsed = time.perf_counter() - start
+    proc.stdout.read()
+    if proc.wait() != 0:
+        raise RuntimeError(
+            f'{" ".join(command)} exited with {proc.returncode}')
+    return elapsed
+
+
+def heavy_modules_on_help():
+    proc = subprocess.run(
+        [sys.executable, '-c', LAZY_SNIPPET], cwd=ROOT,
+        stdout=subprocess.DEVNULL, stderr=subprocess.PIPE,
+        universal_newlines=True, check=True)
+    return [m for m in proc.stderr.strip().split(',') if m]
+
+
+def summarize(samples):
+    return {
+        'min': min(samples),
+        'median': statistics.median(samples),
+        'max': max(samples),
+    }
+
+
+def run(exe, repeat):
+    results = {'import': [], 'help': [], 'generate': []}
+
+    for _ in range(repeat):
+        results['import'].append(time_import())
+        results['help'].append(time_first_output(exe + ['--help']))
+        results['generate'].append(
+            time_first_output(exe + ['-f', EXAMPLE, '--no-cache']))
+
+    return {k: summarize(v) for k, v in results.items()}
+
+
+def compare(results, baseline, tolerance):
+    regressions = []
+    for name, stats in results.items():
+        if name not in baseline:
+            continue
+        limit = baseline[name]['median'] * (1 + tolerance)
+        if stats['median'] > limit:
+            regressions.append(
+                f'{name}: {stats["median"]:.3f}s > {limit:.3f}s'
+                f' (baseline {baseline[name]["median"]:.3f}s)')
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--exe', type=str,
+                        help='benchmark a compiled executable'
+                             ' (e.g. dist/sierra) instead of the sources')
+    parser.add_argument('-n', '--repeat', type=int, default=5,
+                        help='number of runs per measurement')
+    parser.add_argument('-o', '--output', type=str,
+                        help='a file to write the results into')
+    parser.add_argument('--baseline', type=str,
+                        help='a previous results file to compare against')
+    parser.add_argument('--tolerance', type=float, default=0.25,
+                        help='allowed slowdown relative to the baseline')
+
+    args = parser.parse_args()
+
+    exe = [args.exe] if args.exe else [sys.executable, '-m', 'sierra']
+
+    failures = []
+
+    heavy = heavy_modules_on_help()
+    if heavy:
+        failures.append('--help imported ' + ', '.join(heavy))
+
+    results = run(exe, args.repeat)
+
+    for name, stats in results.items():
+        print(f'{name:<10} min {stats["min"]:.3f}s'
+              f'  median {stats["median"]:.3f}s'
+              f'  max {stats["max"]:.3f}s')
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(results, f, indent=2, sort_keys=True)
+
+    if args.baseline:
+        with open(args.baseline) as f:
+            failures.extend(compare(results, json.load(f), args.tolerance))
+
+    for failure in failures:
+        print('FAIL', failure, file=sys.stderr)
+
+    sys.exit(1 if failures else 0)
+
+
+if __name__ == '__main__':
+    main()
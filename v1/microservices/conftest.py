@@ -0,0 +1,17 @@
+import copy
+import json
+import os
+
+import pytest
+
+
+# Being in the root of the project, this also lets the tests import sierra
+EXAMPLES = os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                        'examples')
+
+
+@pytest.fixture
+def sierrafile():
+    """The JSON of the full example Sierrafile, free to change."""
+    with open(os.path.join(EXAMPLES, 'Sierrafile.full')) as f:
+        return copy.deepcopy(json.load(f))
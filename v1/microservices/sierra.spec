@@ -7,7 +7,10 @@ a = Analysis(['sierra/__main__.py'],
              pathex=[],
              binaries=[],
              datas=[],
-             hiddenimports=['troposphere'],
+             hiddenimports=['troposphere', 'sierra.config', 'sierra.template',
+                            'sierra.batch', 'sierra.serve', 'sierra.shard',
+                            'sierra.validate', 'sierra.diff',
+                            'sierra.overlay', 'sierra.plan'],
              hookspath=[],
              runtime_hooks=[],
              excludes=[],
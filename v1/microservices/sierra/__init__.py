@@ -0,0 +1,3 @@
+"""CloudFormation template generator for microservices."""
+
+__version__ = '1.0.0'
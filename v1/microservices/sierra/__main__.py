@@ -2,50 +2,247 @@
 """
 
 import argparse
-import json
+import importlib
+import os
+import shutil
 import sys
+from contextlib import contextmanager
 
-from sierra.config import parse
-from sierra.template import build_template
-from sierra.utils import AttrDict
+from sierra.cache import DEFAULT_MAX_SIZE, Cache, FragmentCache, cache_key
+from sierra.timings import Timings
+from sierra.utils import error_lines, load
 
 
-def main():
-    parser = argparse.ArgumentParser(description=__doc__)
+COMMANDS = {
+    'build': ('sierra.batch', 'main',
+              'generate templates for many Sierrafiles'),
+    'watch': ('sierra.serve', 'watch',
+              'regenerate a template whenever its Sierrafile changes'),
+    'serve': ('sierra.serve', 'serve',
+              'answer template requests on a Unix socket'),
+    'validate': ('sierra.validate', 'main',
+                 'check Sierrafiles for mistakes'),
+    'diff': ('sierra.diff', 'main',
+             'list the resources that differ between two templates'),
+    'overlay': ('sierra.overlay', 'main',
+                'generate templates for several environments at once'),
+    'plan': ('sierra.plan', 'main',
+             'estimate how long creating the stack takes'),
+}
+
+
+def main(argv=None):
+    argv = sys.argv[1:] if argv is None else argv
+
+    if argv and argv[0] in COMMANDS:
+        module, function, _ = COMMANDS[argv[0]]
+        module = importlib.import_module(module)
+        return getattr(module, function)(argv[1:])
+
+    parser = argparse.ArgumentParser(
+        description=__doc__,
+        formatter_class=argparse.RawDescriptionHelpFormatter,
+        epilog='commands:\n' + '\n'.join(
+            f'  {name:<22}{description}'
+            for name, (_, _, description) in COMMANDS.items()
+        ),
+    )
     parser.add_argument('-f', '--file', type=str,
                         default='Sierrafile',
                         help='specify the Sierrafile to use')
-    parser.add_argument('-o', '--out', type=argparse.FileType('w'),
-                        default=sys.stdout,
+    parser.add_argument('-o', '--out', type=str,
                         help='a file to write output into')
     parser.add_argument('--format', choices=['yaml', 'json'],
                         default='yaml',
                         help='specify the output file format')
     parser.add_argument('--compact', action='store_true',
                         help='make output compact (only for json)')
+    parser.add_argument('--minify', action='store_true',
+                        help='make output as small as possible, reporting'
+                             ' the bytes saved on stderr')
+    parser.add_argument('--shard-size', type=int, metavar='SERVICES',
+                        help='split the template into nested stacks of this'
+                             ' many services each (requires --out-dir)')
+    parser.add_argument('-d', '--out-dir', type=str,
+                        help='a directory to write nested stacks into')
+    parser.add_argument('--no-cache', action='store_true',
+                        help='always build the template from scratch')
+    parser.add_argument('--cache-dir', type=str,
+                        help='a directory to cache generated templates in')
+    parser.add_argument('--cache-size', type=int,
+                        default=DEFAULT_MAX_SIZE // 2**20,
+                        help='the size in MB the cache is trimmed down to')
+    parser.add_argument('--timings', action='store_true',
+                        help='report the time spent in every phase as JSON'
+                             ' on stderr')
+    parser.add_argument('--profile', type=str, metavar='FILE',
+                        help='write cProfile statistics into a file')
+
+    args = parser.parse_args(argv)
+
+    if (args.shard_size is None) != (args.out_dir is None):
+        parser.error('--shard-size and --out-dir must be used together')
+    if args.shard_size is not None and args.shard_size < 1:
+        parser.error('--shard-size must be at least 1')
+
+    timings = Timings() if args.timings else None
+
+    profile = None
+    if args.profile:
+        import cProfile
+        profile = cProfile.Profile()
+        profile.enable()
 
-    args = parser.parse_args()
+    try:
+        generate(parser, args, timings)
+    finally:
+        if profile:
+            profile.disable()
+            profile.dump_stats(args.profile)
+
+    if timings:
+        timings.report()
+
+
+@contextmanager
+def open_output(parser, path, timings=None):
+    """Open the output file, or standard output if there is none."""
+    if path is None:
+        yield timings.writer(sys.stdout) if timings else sys.stdout
+        return
 
     try:
-        with open(args.file) as f:
-            raw_sierrafile = json.load(f, object_hook=AttrDict)
+        out = open(path, 'w')
+    except OSError as e:
+        parser.error(f"argument -o/--out: can't open '{path}': {e}")
+    with out:
+        yield timings.writer(out) if timings else out
+
+
+def generate(parser, args, timings=None):
+    # The output is only opened once there is something to write into it,
+    # so that a mistake does not destroy the last template.
+    try:
+        raw_sierrafile = load(args.file)
     except FileNotFoundError:
         parser.print_help()
         parser.exit()
+    except ValueError as e:
+        parser.exit(1, f'{args.file}: invalid JSON: {e}\n')
+
+    if timings:
+        timings.lap('load')
+
+    # Templates and fragments each get half of the cache size
+    cache_size = args.cache_size * 2**20 // 2
+    cache, key, fragments = None, None, None
+    if not args.no_cache:
+        fragments = FragmentCache(args.cache_dir, cache_size)
+
+    # Nested stacks are written into several files, which are not cached
+    if not args.no_cache and not args.shard_size:
+        cache = Cache(args.cache_dir, cache_size)
+        key = cache_key(raw_sierrafile, format=args.format,
+                        compact=args.compact, minify=args.minify)
+        cached = cache.open(key)
+        if timings:
+            timings.cached = bool(cached)
+            timings.lap('cache')
+        if cached:
+            with cached, open_output(parser, args.out, timings) as out:
+                shutil.copyfileobj(cached, out)
+            if timings:
+                timings.lap('serialize')
+            if args.minify:
+                print('minified template read from the cache, use --no-cache'
+                      ' to report the bytes saved', file=sys.stderr)
+            return
+
+    # Troposphere and awacs account for most of the startup time, so they
+    # are only imported once we know there is a template to build.
+    from sierra.config import parse
+    from sierra.output import dump
+    from sierra.template import build_template
+
+    if timings:
+        timings.lap('import')
+
+    try:
+        sierrafile = parse(raw_sierrafile)
+    except ValueError as e:
+        parser.exit(1, error_lines(args.file, e))
+
+    if timings:
+        timings.lap('parse')
+
+    savings, compact = None, args.compact
+    if args.minify:
+        from sierra.minify import Savings
+        savings, compact = Savings(args.format), True
+
+    if args.shard_size:
+        from sierra.output import EXTENSIONS
+        from sierra.shard import build_stacks
+
+        extension = EXTENSIONS[args.format]
+        parent, stacks = build_stacks(
+            sierrafile, args.shard_size, extension, fragments, timings)
+
+        os.makedirs(args.out_dir, exist_ok=True)
+        stacks['template' + extension] = parent
+        for filename, template in stacks.items():
+            with open(os.path.join(args.out_dir, filename), 'w') as f:
+                if savings:
+                    template = savings.minify(template)
+                    f = savings.writer(f)
+                if timings:
+                    timings.count(template)
+                    f = timings.writer(f)
+                dump(template, f, args.format, compact)
+
+        if timings:
+            timings.lap('serialize')
+        if savings:
+            savings.report()
+        return
+
+    template = build_template(sierrafile, fragments, timings)
+
+    if timings:
+        timings.count(template)
+
+    if savings:
+        template = savings.minify(template)
+        if timings:
+            timings.lap('minify')
 
-    sierrafile = parse(raw_sierrafile)
-    template = build_template(sierrafile)
+    cached = None
+    if cache:
+        try:
+            with cache.store(key) as f:
+                dump(template, f, args.format, compact)
+        except OSError:
+            pass
+        cached = cache.open(key)
 
-    if args.format == 'json':
-        result = template.to_json()
-        if args.compact:
-            result = json.loads(result)
-            result = json.dumps(result, separators=(',', ':'))
-    else:
-        result = template.to_yaml()
+    with open_output(parser, args.out, timings) as out:
+        if savings:
+            out = savings.writer(out)
+        if cached:
+            with cached:
+                shutil.copyfileobj(cached, out)
+        else:
+            dump(template, out, args.format, compact)
 
-    print(result, file=args.out)
+    if timings:
+        timings.lap('serialize')
+    if savings:
+        savings.report()
 
 
 if __name__ == '__main__':
-    main()
+    # Worker processes of a frozen executable start it again, and have to
+    # be told apart before the command line is read.
+    import multiprocessing
+    multiprocessing.freeze_support()
+    sys.exit(main())
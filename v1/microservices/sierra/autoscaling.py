@@ -0,0 +1,70 @@
+"""Auto Scaling warm pools and mixed instances made using Troposphere API.
+
+Troposphere does not appear to support warm pools or mixed instances
+policies at the moment, so we have to make them ourself. If at some point
+they do add support, use that instead and get rid of this file.
+"""
+
+from troposphere import AWSObject, AWSProperty, autoscaling
+from troposphere.validators import boolean, integer
+
+
+basestring = (str, bytes)
+
+
+class InstanceReusePolicy(AWSProperty):
+    props = {
+        'ReuseOnScaleIn': (boolean, False),
+    }
+
+
+class WarmPool(AWSObject):
+    resource_type = 'AWS::AutoScaling::WarmPool'
+
+    props = {
+        'AutoScalingGroupName': (basestring, True),
+        'InstanceReusePolicy': (InstanceReusePolicy, False),
+        'MaxGroupPreparedCapacity': (integer, False),
+        'MinSize': (integer, False),
+        'PoolState': (basestring, False),
+    }
+
+
+class InstancesDistribution(AWSProperty):
+    props = {
+        'OnDemandAllocationStrategy': (basestring, False),
+        'OnDemandBaseCapacity': (integer, False),
+        'OnDemandPercentageAboveBaseCapacity': (integer, False),
+        'SpotAllocationStrategy': (basestring, False),
+        'SpotInstancePools': (integer, False),
+        'SpotMaxPrice': (basestring, False),
+    }
+
+
+class LaunchTemplateOverrides(AWSProperty):
+    props = {
+        'InstanceType': (basestring, False),
+        'WeightedCapacity': (basestring, False),
+    }
+
+
+class LaunchTemplate(AWSProperty):
+    props = {
+        'LaunchTemplateSpecification': (
+            autoscaling.LaunchTemplateSpecification, True),
+        'Overrides': ([LaunchTemplateOverrides], False),
+    }
+
+
+class MixedInstancesPolicy(AWSProperty):
+    props = {
+        'InstancesDistribution': (InstancesDistribution, False),
+        'LaunchTemplate': (LaunchTemplate, True),
+    }
+
+
+class AutoScalingGroup(autoscaling.AutoScalingGroup):
+    props = dict(
+        autoscaling.AutoScalingGroup.props,
+        MixedInstancesPolicy=(MixedInstancesPolicy, False),
+    )
@@ -0,0 +1,164 @@
+"""Generate CloudFormation templates for many Sierrafiles at once.
+
+Every input is either a Sierrafile, a glob pattern or a directory. Directories
+are searched recursively for files named Sierrafile or Sierrafile.*. The
+templates are built on a pool of worker processes, which import troposphere
+once and then build as many templates as they are handed.
+"""
+
+import argparse
+import glob
+import os
+import shutil
+import sys
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from concurrent.futures.process import BrokenProcessPool
+
+from .cache import DEFAULT_MAX_SIZE, Cache, FragmentCache, cache_key
+from .utils import load
+
+
+def glob_root(pattern):
+    """Return the directory a glob pattern matches files beneath."""
+    root = os.path.dirname(pattern)
+    while glob.has_magic(root):
+        root = os.path.dirname(root)
+    return root or os.curdir
+
+
+def find_sierrafiles(inputs, out_dir, format):
+    """Map every Sierrafile matched by the inputs to its output path."""
+    from .output import EXTENSIONS
+
+    jobs = {}
+
+    def add(path, relpath):
+        out_path = os.path.join(out_dir, relpath + EXTENSIONS[format])
+        if out_path in jobs.values():
+            raise ValueError(f'more than one Sierrafile would be written'
+                             f' to {out_path}')
+        jobs.setdefault(path, out_path)
+
+    for pattern in inputs:
+        if os.path.isdir(pattern):
+            for root, _, filenames in os.walk(pattern):
+                for filename in sorted(filenames):
+                    if filename.split('.')[0] == 'Sierrafile':
+                        path = os.path.join(root, filename)
+                        add(path, os.path.relpath(path, pattern))
+        else:
+            root = glob_root(pattern)
+            for path in sorted(glob.glob(pattern)) or [pattern]:
+                add(path, os.path.relpath(path, root))
+
+    return jobs
+
+
+def build_file(path, out_path, format='yaml', compact=False, minify=False,
+               cache=None, fragments=None):
+    """Build one Sierrafile, returning an error message if it failed."""
+    try:
+        raw_sierrafile = load(path)
+        os.makedirs(os.path.dirname(out_path) or '.', exist_ok=True)
+
+        if cache:
+            key = cache_key(raw_sierrafile, format=format, compact=compact,
+                            minify=minify)
+            cached = cache.open(key)
+            if cached:
+                with cached, open(out_path, 'w') as out:
+                    shutil.copyfileobj(cached, out)
+                return
+
+        # Like for a single Sierrafile, troposphere and awacs are only
+        # imported once there is a template to build.
+        from .config import parse
+        from .output import dump
+        from .template import build_template
+
+        sierrafile = parse(raw_sierrafile)
+        template = build_template(sierrafile, fragments)
+        if minify:
+            from .minify import minify as minify_template
+            template, compact = minify_template(template, format), True
+        with open(out_path, 'w') as out:
+            dump(template, out, format, compact)
+
+        if cache:
+            try:
+                with open(out_path) as built, cache.store(key) as cached:
+                    shutil.copyfileobj(built, cached)
+            except OSError:
+                pass
+    except Exception as e:
+        return f'{type(e).__name__}: {e}'
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog='sierra build', description=__doc__)
+    parser.add_argument('inputs', nargs='+', metavar='PATH',
+                        help='a Sierrafile, glob pattern or directory')
+    parser.add_argument('-d', '--out-dir', type=str, required=True,
+                        help='a directory to write the templates into')
+    parser.add_argument('--format', choices=['yaml', 'json'],
+                        default='yaml',
+                        help='specify the output file format')
+    parser.add_argument('--compact', action='store_true',
+                        help='make output compact (only for json)')
+    parser.add_argument('--minify', action='store_true',
+                        help='make output as small as possible')
+    parser.add_argument('-j', '--jobs', type=int, default=os.cpu_count(),
+                        help='number of worker processes to use')
+    parser.add_argument('--no-cache', action='store_true',
+                        help='always build the templates from scratch')
+    parser.add_argument('--cache-dir', type=str,
+                        help='a directory to cache generated templates in')
+    parser.add_argument('--cache-size', type=int,
+                        default=DEFAULT_MAX_SIZE // 2**20,
+                        help='the size in MB the cache is trimmed down to')
+
+    args = parser.parse_args(argv)
+
+    try:
+        jobs = find_sierrafiles(args.inputs, args.out_dir, args.format)
+    except ValueError as e:
+        parser.error(str(e))
+
+    cache, fragments = None, None
+    if not args.no_cache:
+        # Templates and fragments each get half of the cache size
+        cache_size = args.cache_size * 2**20 // 2
+        cache = Cache(args.cache_dir, cache_size)
+        fragments = FragmentCache(args.cache_dir, cache_size)
+
+    options = (args.format, args.compact, args.minify, cache, fragments)
+    failures = 0
+
+    def report(path, error):
+        if error:
+            print(f'FAIL {path}: {error}', file=sys.stderr)
+        else:
+            print(f'ok   {path} -> {jobs[path]}', file=sys.stderr)
+        return 1 if error else 0
+
+    if args.jobs <= 1 or len(jobs) <= 1:
+        for path, out_path in jobs.items():
+            failures += report(path, build_file(path, out_path, *options))
+    else:
+        with ProcessPoolExecutor(max_workers=args.jobs) as executor:
+            futures = {
+                executor.submit(build_file, path, out_path, *options): path
+                for path, out_path in jobs.items()
+            }
+            for future in as_completed(futures):
+                try:
+                    error = future.result()
+                except BrokenProcessPool as e:
+                    # A worker died, which fails every build left
+                    error = f'{type(e).__name__}: {e}'
+                failures += report(futures[future], error)
+
+    print(f'{len(jobs) - failures} of {len(jobs)} templates built',
+          file=sys.stderr)
+
+    return 1 if failures else 0
@@ -0,0 +1,171 @@
+"""On-disk cache for generated templates.
+
+A template only depends on the Sierrafile, the output options and the
+versions of Sierra and its dependencies that generated it, so the output
+can be stored under a hash of those and served again without building
+anything. This module must not import troposphere, since avoiding that
+import is most of the gain.
+"""
+
+import glob
+import hashlib
+import json
+import os
+import sys
+import tempfile
+from contextlib import contextmanager
+from functools import lru_cache
+
+from . import __version__
+
+
+DEFAULT_MAX_SIZE = 64 * 1024 * 1024
+
+# Distributions whose code ends up in the templates
+DEPENDENCIES = ('troposphere', 'awacs', 'cfn_flip', 'PyYAML')
+
+
+def default_directory():
+    base = os.environ.get('XDG_CACHE_HOME') or os.path.join(
+        os.path.expanduser('~'), '.cache')
+    return os.path.join(base, 'sierra')
+
+
+def dependency_version(name):
+    """Find the installed version of a distribution without importing it."""
+    # Installers differ in the case of the names of distributions
+    prefix = ''.join(
+        f'[{c.lower()}{c.upper()}]' if c.isalpha() else c for c in name)
+    for directory in sys.path:
+        pattern = os.path.join(directory or os.curdir, prefix + '-*.*-info')
+        for info in glob.glob(pattern):
+            return os.path.splitext(os.path.basename(info))[0][len(name) + 1:]
+    return None
+
+
+@lru_cache(maxsize=None)
+def tool_version():
+    """Identify the code generating templates.
+
+    Frozen executables are identified by the size and modification time of
+    the executable, which change with every build. When running from
+    source, the modification times and sizes of the sources are used, so
+    that editing the generator does not serve stale templates. Both include
+    the versions of the dependencies, in case those are upgraded alone.
+    """
+    dependencies = [(name, dependency_version(name)) for name in DEPENDENCIES]
+
+    if getattr(sys, 'frozen', False):
+        stat = os.stat(sys.executable)
+        return (__version__, stat.st_mtime, stat.st_size, dependencies)
+
+    package = os.path.dirname(os.path.abspath(__file__))
+    stats = []
+    for path in sorted(glob.glob(os.path.join(package, '*.py'))):
+        stat = os.stat(path)
+        stats.append((os.path.basename(path), stat.st_mtime, stat.st_size))
+
+    return (__version__, stats, dependencies)
+
+
+def cache_key(raw_sierrafile, **options):
+    """Hash a Sierrafile and the output options in a canonical form."""
+    canonical = json.dumps(
+        [raw_sierrafile, options, tool_version()],
+        sort_keys=True,
+        separators=(',', ':'),
+    )
+    return hashlib.sha256(canonical.encode('utf-8')).hexdigest()
+
+
+class Cache:
+    """A directory of generated templates evicted least recently used first.
+    """
+
+    def __init__(self, directory=None, max_size=DEFAULT_MAX_SIZE):
+        self.directory = directory or default_directory()
+        self.max_size = max_size
+        self.size = None
+
+    def path(self, key):
+        return os.path.join(self.directory, key)
+
+    def open(self, key):
+        """Return the cached output for a key, or None on a miss."""
+        path = self.path(key)
+        try:
+            os.utime(path)
+            return open(path)
+        except OSError:
+            return None
+
+    @contextmanager
+    def store(self, key):
+        """Write a new entry, which only becomes visible once complete."""
+        os.makedirs(self.directory, exist_ok=True)
+        fd, tmp_path = tempfile.mkstemp(dir=self.directory, suffix='.tmp')
+        try:
+            with open(fd, 'w') as f:
+                yield f
+            size = os.path.getsize(tmp_path)
+            os.replace(tmp_path, self.path(key))
+        except BaseException:
+            os.unlink(tmp_path)
+            raise
+
+        # The directory is only scanned when the cache might be full, so
+        # that storing many small entries in a row stays cheap.
+        if self.size is None:
+            self.evict()
+        else:
+            self.size += size
+            if self.size > self.max_size:
+                self.evict()
+
+    def evict(self):
+        entries = []
+        for entry in os.scandir(self.directory):
+            if entry.is_file() and not entry.name.endswith('.tmp'):
+                stat = entry.stat()
+                entries.append((stat.st_mtime, stat.st_size, entry.path))
+
+        self.size = sum(size for _, size, _ in entries)
+        if self.size <= self.max_size:
+            return
+
+        # Leave some room, so that the next few entries fit without another
+        # scan of the directory.
+        for _, size, path in sorted(entries):
+            if self.size <= self.max_size * 3 // 4:
+                break
+            try:
+                os.unlink(path)
+            except FileNotFoundError:
+                pass
+            self.size -= size
+
+
+class FragmentCache(Cache):
+    """Per-service template fragments, see sierra.template.build_template.
+    """
+
+    def __init__(self, directory=None, max_size=DEFAULT_MAX_SIZE):
+        directory = directory or default_directory()
+        super().__init__(os.path.join(directory, 'fragments'), max_size)
+
+    def get(self, key):
+        f = self.open(key)
+        if f is None:
+            return None
+        with f:
+            try:
+                return json.load(f)
+            except ValueError:
+                return None
+
+    def __setitem__(self, key, fragment):
+        try:
+            with self.store(key) as f:
+                json.dump(fragment, f, separators=(',', ':'))
+        except OSError:
+            pass
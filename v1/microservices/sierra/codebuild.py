@@ -0,0 +1,30 @@
+"""CodeBuild project cache made using Troposphere API.
+
+Troposphere only knows about the NO_CACHE and S3 cache types at the moment,
+so we have to extend it ourself to get local caching. If at some point they
+do add support for it, use that instead and get rid of this file.
+"""
+
+from troposphere import codebuild
+
+
+basestring = (str, bytes)
+
+
+class ProjectCache(codebuild.ProjectCache):
+    props = {
+        'Location': (basestring, False),
+        'Modes': ([basestring], False),
+        'Type': (basestring, True),
+    }
+
+    def validate(self):
+        valid_types = [
+            'LOCAL',
+            'NO_CACHE',
+            'S3',
+        ]
+        cache_type = self.properties.get('Type')
+        if cache_type not in valid_types:
+            raise ValueError('ProjectCache Type: must be one of %s' %
+                             ','.join(valid_types))
@@ -1,60 +1,124 @@
+from collections import OrderedDict
+
 from troposphere import Ref, Sub
+from .model import (
+    CLUSTER_DEFAULTS, DEFAULTS, ENABLING_SECTIONS, LOAD_BALANCER_DEFAULTS,
+    SERVICE_SECTIONS, Cluster, ClusterScaling, HostDeployment, Instances,
+    LoadBalancer, Service, Sierrafile, WarmPool, compile_section)
 from .template import ELB_NAME
-from .utils import AttrDict
-
-
-DEFAULTS = AttrDict({
-    'container': AttrDict({
-        'count': 1,
-        'cpu': 128,
-        'memory': 256,
-    }),
-    'pipeline': AttrDict({
-        'enable': False,
-    }),
-})
+from .utils import merge
+from .validate import format_error, validate
 
 
 def parse(raw_sierrafile):
-    def update(old, new):
-        for k, v in new.items():
-            if isinstance(v, dict):
-                old[k] = update(old.get(k, AttrDict()), v)
-            else:
-                old.setdefault(k, v)
-        return old
+    errors = validate(raw_sierrafile)
+    if errors:
+        raise ValueError('\n'.join(format_error(*e) for e in errors))
 
     environment = raw_sierrafile.get('environment', {})
-    extra_params, env_vars = [], {}
+    extra_params, env_vars = [], OrderedDict()
 
     for name, value in environment.items():
         if value is None:
             identifier = 'EnvironmentVariable' + str(len(extra_params))
             env_vars[name] = Ref(identifier)
             extra_params.append((identifier, name))
-        elif isinstance(value, str):
-            if '{ENDPOINT}' in value:
-                value = Sub(value.format(ENDPOINT=f'${{{ELB_NAME}.DNSName}}'))
-            env_vars[name] = value
+        elif '{ENDPOINT}' in value:
+            env_vars[name] = Sub(
+                value.format(ENDPOINT=f'${{{ELB_NAME}.DNSName}}'))
         else:
-            raise TypeError()
+            env_vars[name] = value
+
+    raw_cluster = raw_sierrafile.get('cluster', {})
+    cluster = Cluster(
+        scaling=compile_section(ClusterScaling, merge(
+            {'enable': True} if 'scaling' in raw_cluster else {},
+            raw_cluster.get('scaling', {}),
+            CLUSTER_DEFAULTS['scaling'],
+        )),
+        deployment=compile_section(HostDeployment, merge(
+            raw_cluster.get('deployment', {}),
+            CLUSTER_DEFAULTS['deployment'],
+        )),
+        bootstrap=raw_cluster.get('bootstrap', CLUSTER_DEFAULTS['bootstrap']),
+        instances=compile_section(Instances, merge(
+            {'enable': True} if 'instances' in raw_cluster else {},
+            raw_cluster.get('instances', {}),
+            CLUSTER_DEFAULTS['instances'],
+        )),
+        warm_pool=compile_section(WarmPool, merge(
+            {'enable': True} if 'warm_pool' in raw_cluster else {},
+            raw_cluster.get('warm_pool', {}),
+            CLUSTER_DEFAULTS['warm_pool'],
+        )),
+    )
 
-    defaults = raw_sierrafile.get('default', {})
-    services = raw_sierrafile['services']
+    load_balancer = compile_section(LoadBalancer, merge(
+        raw_sierrafile.get('load_balancer', {}),
+        LOAD_BALANCER_DEFAULTS,
+    ))
 
-    for name, service in services.items():
-        if 'pipeline' in service:
-            service.pipeline.enable = True
+    raw_defaults = raw_sierrafile.get('default', {})
+    defaults = Service(None, {
+        key: compile_section(cls, merge(
+            raw_defaults.get(key, {}), DEFAULTS.get(key, {})))
+        for key, cls in SERVICE_SECTIONS.items()
+    })
 
-        update(service, defaults)
-        update(service, DEFAULTS)
+    services = OrderedDict()
+    # Services with the same environment share their variables
+    service_env_vars = {}
 
-        for env_var in service.get('environment', []):
-            if env_var not in environment:
-                raise ValueError()
+    for name, raw_service in raw_sierrafile['services'].items():
+        sections = {}
+        for key, cls in SERVICE_SECTIONS.items():
+            if key not in raw_service:
+                sections[key] = getattr(defaults, key)
+                continue
+            values = merge(
+                raw_service[key],
+                raw_defaults.get(key, {}),
+                DEFAULTS.get(key, {}),
+            )
+            if key in ENABLING_SECTIONS:
+                values['enable'] = True
+            sections[key] = compile_section(cls, values)
 
-    return AttrDict(
+        names = frozenset(
+            raw_service.get('environment', raw_defaults.get('environment', []))
+        )
+
+        if names not in service_env_vars:
+            service_env_vars[names] = OrderedDict(
+                (k, v) for k, v in env_vars.items() if k in names)
+
+        services[name] = Service(
+            name, sections, names, service_env_vars[names])
+
+    if load_balancer.type == 'application':
+        assign_priorities(services)
+
+    return Sierrafile(
         extra_params=extra_params,
         env_vars=env_vars,
         services=services,
+        defaults=defaults,
+        cluster=cluster,
+        load_balancer=load_balancer,
     )
+
+
+def assign_priorities(services):
+    """Give the listener rules without a priority the next free ones."""
+    taken = {
+        service.load_balancer.priority for service in services.values()
+    }
+
+    priority = 0
+    for service in services.values():
+        if service.load_balancer.priority is None:
+            priority += 1
+            while priority in taken:
+                priority += 1
+            service.load_balancer = service.load_balancer._replace(
+                priority=priority)
@@ -0,0 +1,329 @@
+"""Compare two templates resource by resource, for ``sierra diff``.
+
+Either side can be a generated template (JSON or YAML) or a Sierrafile, which
+is built into one first. Resources are compared as the dicts they are written
+as. Whole resources are compared first, so only the ones that changed are
+looked into, property by property.
+
+A change to some properties makes CloudFormation replace the resource with a
+new one, which in turn changes everything referring to it. Those properties
+are listed below by resource type. The list only covers the resources that
+Sierra generates.
+"""
+
+import argparse
+import re
+import sys
+from collections import namedtuple
+
+from .utils import error_lines, load_template
+
+
+SECTIONS = ('Parameters', 'Resources', 'Outputs')
+
+# Resources that cannot be updated at all, only replaced
+IMMUTABLE_TYPES = (
+    'AWS::AutoScaling::LaunchConfiguration',
+    'AWS::ECS::TaskDefinition',
+)
+
+# Properties whose change replaces the resource, by resource type
+REPLACING_PROPERTIES = {
+    'AWS::ApplicationAutoScaling::ScalableTarget': (
+        'ResourceId', 'ScalableDimension', 'ServiceNamespace',
+    ),
+    'AWS::ApplicationAutoScaling::ScalingPolicy': (
+        'PolicyName', 'ResourceId', 'ScalableDimension', 'ServiceNamespace',
+    ),
+    'AWS::AutoScaling::AutoScalingGroup': (
+        'AutoScalingGroupName', 'InstanceId',
+    ),
+    'AWS::AutoScaling::WarmPool': ('AutoScalingGroupName',),
+    'AWS::CodeBuild::Project': ('Name',),
+    'AWS::CodePipeline::Pipeline': ('Name',),
+    'AWS::CodePipeline::Webhook': ('Name',),
+    'AWS::EC2::LaunchTemplate': ('LaunchTemplateName',),
+    'AWS::EC2::Route': ('DestinationCidrBlock', 'RouteTableId'),
+    'AWS::EC2::RouteTable': ('VpcId',),
+    'AWS::EC2::SecurityGroup': ('GroupDescription', 'GroupName', 'VpcId'),
+    'AWS::EC2::Subnet': ('AvailabilityZone', 'CidrBlock', 'VpcId'),
+    'AWS::EC2::SubnetRouteTableAssociation': ('RouteTableId', 'SubnetId'),
+    'AWS::EC2::VPC': ('CidrBlock',),
+    'AWS::ECS::CapacityProvider': (
+        'AutoScalingGroupProvider.AutoScalingGroupArn', 'Name',
+    ),
+    'AWS::ECS::Cluster': ('ClusterName',),
+    'AWS::ECS::ClusterCapacityProviderAssociations': ('Cluster',),
+    'AWS::ECS::Service': (
+        'Cluster', 'DeploymentController', 'LaunchType', 'Role',
+        'SchedulingStrategy', 'ServiceName',
+    ),
+    'AWS::ElasticLoadBalancingV2::Listener': ('LoadBalancerArn',),
+    'AWS::ElasticLoadBalancingV2::ListenerRule': ('ListenerArn',),
+    'AWS::ElasticLoadBalancingV2::LoadBalancer': ('Name', 'Scheme', 'Type'),
+    'AWS::ElasticLoadBalancingV2::TargetGroup': (
+        'Name', 'Port', 'Protocol', 'TargetType', 'VpcId',
+    ),
+    'AWS::IAM::InstanceProfile': ('InstanceProfileName', 'Path'),
+    'AWS::IAM::Role': ('Path', 'RoleName'),
+    'AWS::Logs::LogGroup': ('LogGroupName',),
+    'AWS::S3::Bucket': ('BucketName',),
+}
+
+# The resources named by ${Name} and ${Name.Attribute} in a Fn::Sub string
+SUB_REFERENCE = re.compile(r'\$\{([A-Za-z0-9]+)[.}]')
+
+# A change to an entry of a section. Modified entries list the changes to
+# their values, with the causes of their replacement if any.
+Change = namedtuple('Change', 'action name type replacement values')
+
+ValueChange = namedtuple('ValueChange', 'action path replacement cause')
+
+
+def diff(old, new):
+    """Compare two template dicts, returning the changes of every section.
+    """
+    changes = {}
+    for section in SECTIONS:
+        changes[section] = diff_section(
+            old.get(section, {}), new.get(section, {}),
+            section == 'Resources')
+
+    propagate(changes['Resources'], new.get('Resources', {}))
+    return changes
+
+
+def diff_section(old, new, resources=False):
+    changes = {}
+    for name in old:
+        if name not in new:
+            changes[name] = Change(
+                '-', name, old[name].get('Type'), False, [])
+
+    for name, value in new.items():
+        if name not in old:
+            changes[name] = Change('+', name, value.get('Type'), False, [])
+        elif old[name] != value:
+            if resources:
+                changes[name] = diff_resource(name, old[name], value)
+            else:
+                values = []
+                compare(values, '', old[name], value)
+                changes[name] = Change(
+                    '~', name, value.get('Type'), False, values)
+
+    return changes
+
+
+def diff_resource(name, old, new):
+    resource_type = new.get('Type')
+    if old.get('Type') != resource_type:
+        return Change('~', name, resource_type, True, [
+            ValueChange('~', 'Type', True, None),
+        ])
+
+    values = []
+    for key in sorted(set(old) | set(new)):
+        if key != 'Properties':
+            compare(values, key, old.get(key), new.get(key))
+
+    properties = []
+    compare(properties, '', old.get('Properties', {}),
+            new.get('Properties', {}))
+    properties = [
+        change._replace(replacement=replaces(resource_type, change.path))
+        for change in properties
+    ]
+
+    return Change(
+        '~', name, resource_type,
+        any(change.replacement for change in properties),
+        sorted(values + properties, key=lambda change: change.path))
+
+
+def compare(changes, path, old, new):
+    """Add the paths of the differences between two values to changes."""
+    if old == new:
+        return
+
+    if (isinstance(old, dict) and isinstance(new, dict)
+            and not is_function(old) and not is_function(new)):
+        for key in sorted(set(old) | set(new)):
+            subpath = f'{path}.{key}' if path else key
+            if key not in old:
+                changes.append(ValueChange('+', subpath, False, None))
+            elif key not in new:
+                changes.append(ValueChange('-', subpath, False, None))
+            else:
+                compare(changes, subpath, old[key], new[key])
+    elif (isinstance(old, list) and isinstance(new, list)
+            and len(old) == len(new)):
+        for index, (old_item, new_item) in enumerate(zip(old, new)):
+            compare(changes, f'{path}[{index}]', old_item, new_item)
+    elif old is None:
+        changes.append(ValueChange('+', path, False, None))
+    elif new is None:
+        changes.append(ValueChange('-', path, False, None))
+    else:
+        changes.append(ValueChange('~', path, False, None))
+
+
+def is_function(value):
+    """Whether a dict is a Ref or an intrinsic function, like Fn::Sub."""
+    if len(value) != 1:
+        return False
+    key = next(iter(value))
+    return key == 'Ref' or key.startswith('Fn::')
+
+
+def replaces(resource_type, path):
+    """Whether changing a property of a resource type replaces it."""
+    if resource_type in IMMUTABLE_TYPES:
+        return True
+
+    for prop in REPLACING_PROPERTIES.get(resource_type, ()):
+        if path == prop or path.startswith((prop + '.', prop + '[')):
+            return True
+    return False
+
+
+def references(properties):
+    """Yield the property paths and names of the resources referred to."""
+    stack = [('', properties)]
+    while stack:
+        path, value = stack.pop()
+        if isinstance(value, dict):
+            if is_function(value):
+                key, argument = next(iter(value.items()))
+                if key == 'Ref':
+                    yield path, argument
+                    continue
+                if key == 'Fn::GetAtt':
+                    yield path, argument[0]
+                    continue
+                if key == 'Fn::Sub':
+                    if isinstance(argument, list):
+                        argument = argument[0]
+                    for name in SUB_REFERENCE.findall(argument):
+                        yield path, name
+            items = value.items()
+        elif isinstance(value, list):
+            items = enumerate(value)
+        else:
+            continue
+
+        # Only containers can hold references, so leave out anything else
+        for key, item in items:
+            if isinstance(item, (dict, list)):
+                if isinstance(key, int):
+                    stack.append((f'{path}[{key}]', item))
+                else:
+                    stack.append((f'{path}.{key}' if path else key, item))
+
+
+def propagate(changes, resources):
+    """Add the changes caused by replaced resources to everything that
+    refers to them, which may get replaced in turn.
+    """
+    replaced = [
+        change.name for change in changes.values() if change.replacement
+    ]
+    if not replaced:
+        return
+
+    # Every resource referring to another, with the path of the reference
+    referrers = {}
+    for name, resource in resources.items():
+        for path, target in references(resource.get('Properties', {})):
+            referrers.setdefault(target, []).append((name, path))
+
+    while replaced:
+        target = replaced.pop()
+        for name, path in referrers.get(target, []):
+            change = changes.get(name)
+            if change is None:
+                change = Change('~', name, resources[name].get('Type'),
+                                False, [])
+            elif change.action != '~':
+                continue
+
+            replacement = replaces(change.type, path)
+            value = ValueChange('~', path, replacement, target)
+            if value in change.values:
+                continue
+
+            changes[name] = change._replace(
+                replacement=change.replacement or replacement,
+                values=change.values + [value])
+            if replacement and not change.replacement:
+                replaced.append(name)
+
+
+def report(changes, out=sys.stdout):
+    """Write the changes, returning whether there were any."""
+    found = False
+    for section in SECTIONS:
+        if not changes[section]:
+            continue
+        found = True
+
+        out.write(f'{section}\n')
+        for name in sorted(changes[section]):
+            change = changes[section][name]
+            line = f'{change.action} {name}'
+            if change.type:
+                line += f' ({change.type})'
+            if change.replacement:
+                line += ' replacement'
+            out.write(line + '\n')
+
+            for value in change.values:
+                line = f'    {value.action} {value.path}'
+                if value.cause:
+                    line += f' refers to {value.cause}'
+                if value.replacement:
+                    line += ' replacement'
+                out.write(line + '\n')
+
+        counts = {'+': 0, '-': 0, '~': 0}
+        for change in changes[section].values():
+            counts[change.action] += 1
+        summary = (f'{counts["+"]} added, {counts["-"]} removed,'
+                   f' {counts["~"]} modified')
+        if section == 'Resources':
+            replaced = sum(
+                change.replacement for change in changes[section].values())
+            summary += f' ({replaced} replaced)'
+        out.write(f'{summary}\n\n')
+
+    return found
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        prog='sierra diff',
+        description='List the resources that differ between two templates'
+                    ' or Sierrafiles.')
+    parser.add_argument('old', metavar='OLD',
+                        help='the template or Sierrafile deployed now')
+    parser.add_argument('new', metavar='NEW',
+                        help='the template or Sierrafile to deploy')
+
+    args = parser.parse_args(argv)
+
+    # Services that did not change are only built once
+    fragments = {}
+    templates = []
+    for path in (args.old, args.new):
+        try:
+            templates.append(load_template(path, fragments))
+        except OSError as e:
+            parser.error(str(e))
+        except ValueError as e:
+            parser.exit(1, error_lines(path, e))
+    old, new = templates
+
+    if not report(diff(old, new)):
+        print('no changes', file=sys.stderr)
+        return 0
+    return 1
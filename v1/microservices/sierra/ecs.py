@@ -0,0 +1,57 @@
+"""ECS capacity providers made using Troposphere API.
+
+Troposphere does not appear to support capacity providers at the moment, so
+we have to make them ourself. If at some point they do add support, use that
+instead and get rid of this file.
+"""
+
+from troposphere import AWSObject, AWSProperty
+from troposphere.validators import integer
+
+
+basestring = (str, bytes)
+
+
+class ManagedScaling(AWSProperty):
+    props = {
+        'MaximumScalingStepSize': (integer, False),
+        'MinimumScalingStepSize': (integer, False),
+        'Status': (basestring, False),
+        'TargetCapacity': (integer, False),
+    }
+
+
+class AutoScalingGroupProvider(AWSProperty):
+    props = {
+        'AutoScalingGroupArn': (basestring, True),
+        'ManagedScaling': (ManagedScaling, False),
+        'ManagedTerminationProtection': (basestring, False),
+    }
+
+
+class CapacityProvider(AWSObject):
+    resource_type = 'AWS::ECS::CapacityProvider'
+
+    props = {
+        'AutoScalingGroupProvider': (AutoScalingGroupProvider, True),
+        'Name': (basestring, False),
+    }
+
+
+class CapacityProviderStrategy(AWSProperty):
+    props = {
+        'Base': (integer, False),
+        'CapacityProvider': (basestring, True),
+        'Weight': (integer, False),
+    }
+
+
+class ClusterCapacityProviderAssociations(AWSObject):
+    resource_type = 'AWS::ECS::ClusterCapacityProviderAssociations'
+
+    props = {
+        'CapacityProviders': ([basestring], True),
+        'Cluster': (basestring, True),
+        'DefaultCapacityProviderStrategy': (
+            [CapacityProviderStrategy], True),
+    }
@@ -0,0 +1,38 @@
+"""Load balancer listener actions made using Troposphere API.
+
+Troposphere only knows about forward actions at the moment, so we have to
+extend it ourself to answer requests that match no service with a fixed
+response. If at some point they do add support for it, use that instead and
+get rid of this file.
+"""
+
+from troposphere import AWSProperty, elasticloadbalancingv2
+
+
+basestring = (str, bytes)
+
+
+class FixedResponseConfig(AWSProperty):
+    props = {
+        'ContentType': (basestring, False),
+        'MessageBody': (basestring, False),
+        'StatusCode': (basestring, False),
+    }
+
+
+class Action(elasticloadbalancingv2.Action):
+    props = {
+        'FixedResponseConfig': (FixedResponseConfig, False),
+        'TargetGroupArn': (basestring, False),
+        'Type': (basestring, True),
+    }
+
+    def validate(self):
+        valid_types = [
+            'fixed-response',
+            'forward',
+        ]
+        action_type = self.properties.get('Type')
+        if action_type not in valid_types:
+            raise ValueError('Action Type: must be one of %s' %
+                             ','.join(valid_types))
@@ -0,0 +1,284 @@
+"""Make templates smaller than --compact does, for ``sierra --minify``.
+
+minify rewrites a template into an equivalent one that takes fewer bytes:
+
+- Properties set to the value CloudFormation uses anyway are left out.
+- DependsOn leaves out the resources that are referred to anyway.
+- Long values of container environment variables that repeat across
+  services are moved into a mapping and looked up with Fn::FindInMap,
+  wherever that takes fewer bytes than repeating them. Only in JSON though,
+  since YAML writes every lookup on several lines.
+
+Other repetition is left alone. Plenty of properties do not accept
+intrinsic functions, so only those listed in MAPPED_PROPERTIES are looked
+up. Mappings only hold strings, so the
+log configuration or pipeline stages of every service, made of Refs and
+Subs, stay as they are. Conditions would only help templates that create
+resources conditionally, which those of Sierra do not.
+
+The template is not changed in place, since the resources of services are
+shared with the fragment cache. Only what changes is copied.
+"""
+
+import io
+import json
+import sys
+
+from .diff import references
+from .output import dump
+from .timings import CountingWriter
+
+
+# Properties left out when they have the value CloudFormation defaults to,
+# by resource type. A * in a path stands for every item of a list. Leaving
+# out a property changes the template all the same, so none of these would
+# replace anything but task definitions, which every new image does anyway.
+DEFAULT_PROPERTIES = {
+    'AWS::CodePipeline::Pipeline': [
+        ('Stages.*.Actions.*.RunOrder', (1, '1')),
+    ],
+    'AWS::ECS::Service': [
+        ('DeploymentConfiguration.MaximumPercent', (200, '200')),
+        ('DeploymentConfiguration.MinimumHealthyPercent', (100, '100')),
+    ],
+    'AWS::ECS::TaskDefinition': [
+        ('ContainerDefinitions.*.Essential', (True, 'true')),
+        ('ContainerDefinitions.*.PortMappings.*.Protocol', ('tcp',)),
+        ('NetworkMode', ('bridge',)),
+    ],
+}
+
+# Properties whose strings may be looked up in the mapping, by resource
+# type. Each of them accepts intrinsic functions.
+MAPPED_PROPERTIES = {
+    'AWS::ECS::TaskDefinition': [
+        'ContainerDefinitions.*.Environment.*.Value',
+    ],
+}
+
+MAPPING = 'S'
+
+# CloudFormation allows this many keys in a mapping
+MAX_MAPPING_KEYS = 200
+
+
+def minify(template, format='json'):
+    """Return a smaller template dict equivalent to a template."""
+    data = template if isinstance(template, dict) else template.to_dict()
+    data = dict(data)
+
+    resources = {}
+    for title, resource in data.get('Resources', {}).items():
+        resource = drop_defaults(resource)
+        resource = drop_dependencies(resource)
+        resources[title] = resource
+
+    strings = factor_strings(resources) if format == 'json' else {}
+    if strings:
+        mappings = dict(data.get('Mappings', {}))
+        mappings[MAPPING] = {
+            key: {'v': string} for string, key in strings.items()
+        }
+        data['Mappings'] = mappings
+        resources = {
+            title: replace_strings(resource, strings)
+            for title, resource in resources.items()
+        }
+
+    data['Resources'] = resources
+    return data
+
+
+def drop_defaults(resource):
+    defaults = DEFAULT_PROPERTIES.get(resource.get('Type'))
+    if not defaults or 'Properties' not in resource:
+        return resource
+
+    properties = resource['Properties']
+    for path, values in defaults:
+        properties = without(properties, path.split('.'), values)
+
+    if properties is resource['Properties']:
+        return resource
+    return dict(resource, Properties=properties)
+
+
+def without(node, keys, values):
+    """Return a node without what is at the path of the keys if it has one
+    of the values, copying only what changes. Objects left empty go too.
+    """
+    key, rest = keys[0], keys[1:]
+
+    if key == '*':
+        if not isinstance(node, list):
+            return node
+        items = [without(item, rest, values) for item in node]
+        if all(new is old for new, old in zip(items, node)):
+            return node
+        return items
+
+    if not isinstance(node, dict) or key not in node:
+        return node
+
+    if rest:
+        value = without(node[key], rest, values)
+        if value is node[key]:
+            return node
+        copy = dict(node)
+        if value == {}:
+            del copy[key]
+        else:
+            copy[key] = value
+        return copy
+
+    if any(node[key] == value and type(node[key]) is type(value)
+           for value in values):
+        copy = dict(node)
+        del copy[key]
+        return copy
+    return node
+
+
+def drop_dependencies(resource):
+    """Leave out the DependsOn entries CloudFormation infers from Refs."""
+    depends_on = resource.get('DependsOn')
+    if depends_on is None:
+        return resource
+    if not isinstance(depends_on, list):
+        depends_on = [depends_on]
+
+    referred = {
+        target for _, target in references(resource.get('Properties', {}))
+    }
+    needed = [target for target in depends_on if target not in referred]
+
+    copy = dict(resource)
+    if not needed:
+        del copy['DependsOn']
+    elif len(needed) == 1:
+        copy['DependsOn'] = needed[0]
+    else:
+        copy['DependsOn'] = needed
+    return copy
+
+
+def size(value):
+    return len(json.dumps(value, separators=(',', ':')))
+
+
+def lookup(key):
+    return {'Fn::FindInMap': [MAPPING, key, 'v']}
+
+
+def mapped_paths(resource):
+    if 'Properties' not in resource:
+        return []
+    paths = MAPPED_PROPERTIES.get(resource.get('Type'), [])
+    return [path.split('.') for path in paths]
+
+
+def factor_strings(resources):
+    """Choose the strings to look up in a mapping, mapped to their keys."""
+    counts = {}
+    for resource in resources.values():
+        for keys in mapped_paths(resource):
+            for string in strings_at(resource['Properties'], keys):
+                counts[string] = counts.get(string, 0) + 1
+
+    # Every lookup costs about the same, and so does the mapping entry
+    savings = []
+    for string, count in counts.items():
+        length = size(string)
+        saved = count * (length - size(lookup('000'))) - length - 10
+        if saved > 0:
+            savings.append((saved, string))
+
+    savings.sort(key=lambda saving: -saving[0])
+    return {
+        string: str(index)
+        for index, (_, string) in enumerate(savings[:MAX_MAPPING_KEYS])
+    }
+
+
+def strings_at(node, keys):
+    """Yield the strings at the path of the keys."""
+    if not keys:
+        if isinstance(node, str):
+            yield node
+        return
+
+    key, rest = keys[0], keys[1:]
+    if key == '*':
+        if isinstance(node, list):
+            for item in node:
+                yield from strings_at(item, rest)
+    elif isinstance(node, dict) and key in node:
+        yield from strings_at(node[key], rest)
+
+
+def replace_at(node, keys, strings):
+    """Return a node with the strings at the path of the keys looked up,
+    copying only what changes.
+    """
+    if not keys:
+        if isinstance(node, str) and node in strings:
+            return lookup(strings[node])
+        return node
+
+    key, rest = keys[0], keys[1:]
+    if key == '*':
+        if not isinstance(node, list):
+            return node
+        items = [replace_at(item, rest, strings) for item in node]
+        if all(new is old for new, old in zip(items, node)):
+            return node
+        return items
+
+    if not isinstance(node, dict) or key not in node:
+        return node
+    value = replace_at(node[key], rest, strings)
+    if value is node[key]:
+        return node
+    return dict(node, **{key: value})
+
+
+def replace_strings(resource, strings):
+    properties = resource.get('Properties')
+    for keys in mapped_paths(resource):
+        properties = replace_at(properties, keys, strings)
+
+    if properties is resource.get('Properties'):
+        return resource
+    return dict(resource, Properties=properties)
+
+
+class Savings(object):
+    """Minify templates, adding up their bytes before and after.
+
+    Templates are measured as written with --compact before, so that only
+    what --minify adds to it counts.
+    """
+
+    def __init__(self, format='yaml'):
+        self.format = format
+        self.before = 0
+        self.counts = {'bytes': 0}
+
+    def minify(self, template):
+        data = template if isinstance(template, dict) else template.to_dict()
+        out = io.StringIO()
+        dump(data, out, self.format, True)
+        self.before += len(out.getvalue().encode('utf-8'))
+        return minify(data, self.format)
+
+    def writer(self, out):
+        """Count the bytes of the minified templates written into a file."""
+        return CountingWriter(out, self.counts)
+
+    def report(self, out=sys.stderr):
+        after = self.counts['bytes']
+        saved = self.before - after
+        baseline = ('with --compact alone' if self.format == 'json'
+                    else 'without --minify')
+        out.write(f'minified to {after} bytes, {saved} bytes'
+                  f' ({saved / self.before:.1%}) less than {baseline}\n')
@@ -0,0 +1,228 @@
+"""The parsed form of a Sierrafile.
+
+sierra.config.parse compiles the JSON of a Sierrafile into the classes
+below, which the template is built from. Every section of the settings of a
+service is a namedtuple with a field for every option, None if not set. The
+sections are immutable, so every service that does not set a section shares
+the one compiled from the defaults. Like anything else that is not a
+section, nested objects such as pipeline.cache stay plain dicts.
+"""
+
+from collections import OrderedDict, namedtuple
+
+
+LOAD_BALANCER_TYPES = ('network', 'application')
+
+NETWORK_MODES = ('bridge', 'host', 'awsvpc')
+
+# Placement strategy fields, by their short name in a Sierrafile. Spreading
+# over any other attribute:... field is allowed as well.
+PLACEMENT_STRATEGIES = {
+    'binpack': {'cpu': 'cpu', 'memory': 'memory'},
+    'spread': {
+        'az': 'attribute:ecs.availability-zone',
+        'instance': 'instanceId',
+    },
+    'random': {},
+}
+
+PLACEMENT_CONSTRAINTS = ('distinctInstance', 'memberOf')
+
+BUILD_CACHE_TYPES = ('local', 's3')
+
+BUILD_CACHE_MODES = {
+    'docker': 'LOCAL_DOCKER_LAYER_CACHE',
+    'source': 'LOCAL_SOURCE_CACHE',
+    'custom': 'LOCAL_CUSTOM_CACHE',
+}
+
+LOG_MODES = ('blocking', 'non-blocking')
+
+# The retention periods CloudWatch Logs allows, in days
+LOG_RETENTION_DAYS = (
+    1, 3, 5, 7, 14, 30, 60, 90, 120, 150, 180, 365, 400, 545, 731, 1096,
+    1827, 2192, 2557, 2922, 3288, 3653,
+)
+
+# How hosts join the cluster: cfn-init installs and configures everything
+# at boot, a baked AMI already has it all
+HOST_BOOTSTRAPS = ('cfn-init', 'baked')
+
+WARM_POOL_STATES = {
+    'stopped': 'Stopped',
+    'running': 'Running',
+    'hibernated': 'Hibernated',
+}
+
+SPOT_ALLOCATION_STRATEGIES = (
+    'capacity-optimized', 'capacity-optimized-prioritized', 'lowest-price',
+    'price-capacity-optimized',
+)
+
+# Target tracking metrics, by the name of their target in a Sierrafile
+SCALING_METRICS = {
+    'cpu': 'ECSServiceAverageCPUUtilization',
+    'memory': 'ECSServiceAverageMemoryUtilization',
+    'requests': 'ALBRequestCountPerTarget',
+}
+
+DEFAULTS = {
+    'container': {
+        'count': 1,
+        'cpu': 128,
+        'memory': 256,
+        'network_mode': 'bridge',
+    },
+    'pipeline': {
+        'enable': False,
+    },
+    'scaling': {
+        'enable': False,
+    },
+}
+
+CLUSTER_DEFAULTS = {
+    'bootstrap': 'cfn-init',
+    'scaling': {
+        'enable': False,
+        'min': 1,
+        'max': 10,
+        'target': 100,
+    },
+    'deployment': {
+        'batch_size': 1,
+        'min_in_service': 1,
+        'pause': 300,
+        'signal_timeout': 900,
+    },
+    'instances': {
+        'enable': False,
+        'on_demand_base': 0,
+        'on_demand_percentage': 100,
+        'spot_strategy': 'capacity-optimized',
+        'spot_draining': True,
+    },
+    'warm_pool': {
+        'enable': False,
+        'min': 0,
+        'state': 'stopped',
+        'reuse': False,
+    },
+}
+
+LOAD_BALANCER_DEFAULTS = {
+    'type': 'network',
+}
+
+# Sections that turn a feature on by being there
+ENABLING_SECTIONS = ('pipeline', 'scaling')
+
+
+def section(name, fields):
+    """Make a namedtuple whose fields all default to None."""
+    cls = namedtuple(name, fields)
+    cls.__new__.__defaults__ = (None,) * len(cls._fields)
+    return cls
+
+
+# Sections of the settings of a service
+
+Container = section(
+    'Container', 'image port count cpu memory network_mode')
+
+Pipeline = section(
+    'Pipeline', 'enable user repo branch cache')
+
+Scaling = section(
+    'Scaling', 'enable min max cpu memory requests cooldown')
+
+Routing = section(
+    'Routing', 'path host priority health_check deregistration_delay')
+
+Placement = section(
+    'Placement', 'strategy constraints')
+
+Deployment = section(
+    'Deployment', 'min_healthy_percent max_percent')
+
+Logs = section(
+    'Logs', 'mode max_buffer_size multiline_pattern datetime_format'
+            ' retention')
+
+SERVICE_SECTIONS = OrderedDict([
+    ('container', Container),
+    ('pipeline', Pipeline),
+    ('scaling', Scaling),
+    ('load_balancer', Routing),
+    ('placement', Placement),
+    ('deployment', Deployment),
+    ('logs', Logs),
+])
+
+# Sections of the whole stack
+
+ClusterScaling = section(
+    'ClusterScaling', 'enable min max target step')
+
+HostDeployment = section(
+    'HostDeployment', 'batch_size min_in_service pause signal_timeout')
+
+Instances = section(
+    'Instances', 'enable types on_demand_base on_demand_percentage'
+                 ' spot_strategy spot_draining')
+
+WarmPool = section(
+    'WarmPool', 'enable min max_prepared state reuse')
+
+Cluster = section(
+    'Cluster', 'scaling deployment bootstrap instances warm_pool')
+
+LoadBalancer = section(
+    'LoadBalancer', 'type port certificate')
+
+
+def compile_section(cls, values):
+    """Make a section of the options it knows about, ignoring the rest."""
+    return cls(**{k: v for k, v in values.items() if k in cls._fields})
+
+
+class Service(object):
+    """The settings of a service, one attribute for every section.
+
+    environment is the frozenset of the names of the environment variables
+    of the service and env_vars maps them to their values, in the order of
+    the Sierrafile.
+    """
+
+    __slots__ = ('name', 'environment', 'env_vars') + tuple(SERVICE_SECTIONS)
+
+    def __init__(self, name, sections, environment=frozenset(),
+                 env_vars=None):
+        self.name = name
+        for key in SERVICE_SECTIONS:
+            setattr(self, key, sections[key])
+        self.environment = environment
+        self.env_vars = env_vars or OrderedDict()
+
+    def settings(self):
+        """Everything the service is built from but the variable values."""
+        return [self.name, sorted(self.environment)] + [
+            getattr(self, key) for key in SERVICE_SECTIONS
+        ]
+
+
+class Sierrafile(object):
+
+    __slots__ = (
+        'extra_params', 'env_vars', 'services', 'defaults', 'cluster',
+        'load_balancer',
+    )
+
+    def __init__(self, extra_params, env_vars, services, defaults, cluster,
+                 load_balancer):
+        self.extra_params = extra_params
+        self.env_vars = env_vars
+        self.services = services
+        self.defaults = defaults
+        self.cluster = cluster
+        self.load_balancer = load_balancer
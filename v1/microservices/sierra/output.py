@@ -0,0 +1,46 @@
+"""Serialize templates straight into a file.
+
+Troposphere's ``to_json`` and ``to_yaml`` build the whole document as a
+string (``to_yaml`` even goes through ``to_json`` and parses it back). The
+functions here write the template into the file in a single pass instead,
+while producing exactly the same text.
+"""
+
+import json
+
+import yaml
+from cfn_flip.yaml_dumper import Dumper, map_representer
+from cfn_tools.odict import ODict
+
+
+EXTENSIONS = {
+    'json': '.json',
+    'yaml': '.yml',
+}
+
+
+class SortedDumper(Dumper):
+    """The cfn-flip dumper, taking plain dicts with keys sorted like JSON."""
+
+
+def sorted_map_representer(dumper, value):
+    return map_representer(dumper, ODict(sorted(value.items())))
+
+
+SortedDumper.add_representer(dict, sorted_map_representer)
+
+
+def dump(template, out, format='yaml', compact=False):
+    """Write a template, or a template already turned into a dict."""
+    data = template if isinstance(template, dict) else template.to_dict()
+
+    if format == 'json':
+        if compact:
+            json.dump(data, out, sort_keys=True, separators=(',', ':'))
+        else:
+            json.dump(data, out, indent=4, sort_keys=True,
+                      separators=(',', ': '))
+    else:
+        yaml.dump(data, out, Dumper=SortedDumper, default_flow_style=False)
+
+    out.write('\n')
@@ -0,0 +1,112 @@
+"""Generate the templates of several environments of one application.
+
+The environments share a base Sierrafile, and every environment has an
+overlay file with the settings it changes, applied like a JSON merge patch:
+objects are merged key by key and any other value replaces the one of the
+base. Unlike in a merge patch, null is a value like any other, since it
+makes an environment variable a stack parameter, and {"$delete": true}
+removes a key from the base instead. The template of an environment is
+named after its overlay, e.g. prod.yml for prod.json or Sierrafile.prod.
+
+Environments are built together, so resources they have in common are only
+built once: the network, cluster and roles whenever their settings are the
+same, and every service whose settings no overlay changed.
+"""
+
+import argparse
+import os
+import sys
+from collections import OrderedDict
+
+from .config import parse
+from .output import EXTENSIONS, dump
+from .template import build_templates
+from .utils import load
+
+
+# The value that removes a key from the base
+DELETE = {'$delete': True}
+
+
+def apply(base, overlay):
+    """Return the base Sierrafile with an overlay applied.
+
+    Only the objects on the path to a change are copied, anything else is
+    shared with the base.
+    """
+    if not isinstance(overlay, dict):
+        return overlay
+
+    merged = dict(base) if isinstance(base, dict) else {}
+    for key, value in overlay.items():
+        if value == DELETE:
+            merged.pop(key, None)
+        else:
+            merged[key] = apply(merged.get(key), value)
+    return merged
+
+
+def environment_name(path):
+    name = os.path.basename(path)
+    if name.startswith('Sierrafile.'):
+        name = name[len('Sierrafile.'):]
+    if name.endswith('.json'):
+        name = name[:-len('.json')]
+    return name
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        prog='sierra overlay',
+        description=__doc__,
+        formatter_class=argparse.RawDescriptionHelpFormatter,
+    )
+    parser.add_argument('base', metavar='BASE',
+                        help='the Sierrafile all environments start from')
+    parser.add_argument('overlays', nargs='+', metavar='OVERLAY',
+                        help='the settings of an environment')
+    parser.add_argument('-d', '--out-dir', type=str, required=True,
+                        help='a directory to write the templates into')
+    parser.add_argument('--format', choices=['yaml', 'json'],
+                        default='yaml',
+                        help='specify the output file format')
+    parser.add_argument('--compact', action='store_true',
+                        help='make output compact (only for json)')
+
+    args = parser.parse_args(argv)
+
+    try:
+        raw_base = load(args.base)
+    except (OSError, ValueError) as e:
+        parser.error(f'{args.base}: {e}')
+
+    names = OrderedDict()
+    for path in args.overlays:
+        name = environment_name(path)
+        if name in names.values():
+            parser.error(f'more than one overlay is named {name}')
+        names[path] = name
+
+    sierrafiles = OrderedDict()
+    failures = 0
+
+    for path, name in names.items():
+        try:
+            sierrafiles[name] = parse(apply(raw_base, load(path)))
+        except Exception as e:
+            print(f'FAIL {path}: {type(e).__name__}: {e}', file=sys.stderr)
+            failures += 1
+
+    templates = build_templates(sierrafiles)
+
+    os.makedirs(args.out_dir, exist_ok=True)
+    for name, template in templates.items():
+        out_path = os.path.join(args.out_dir, name + EXTENSIONS[args.format])
+        with open(out_path, 'w') as out:
+            dump(template, out, args.format, args.compact)
+        print(f'ok   {name} -> {out_path}', file=sys.stderr)
+
+    print(f'{len(templates)} of {len(names)} templates built',
+          file=sys.stderr)
+
+    return 1 if failures else 0
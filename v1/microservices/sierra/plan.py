@@ -0,0 +1,308 @@
+"""Estimate how long creating a stack takes, for ``sierra plan``.
+
+CloudFormation creates a resource once everything it depends on exists,
+and creates as many resources at once as it can. The dependencies of a
+resource are the resources it names in DependsOn and those it refers to
+with Ref, Fn::GetAtt or Fn::Sub. Given an estimate of how long creating
+every type of resource takes, the earliest time every resource can be
+created follows, and with it the critical path: the chain of dependencies
+that decides how long creating the whole stack takes.
+
+DependsOn entries on resources that are not referred to only order the
+creation of resources. Those on the critical path could be relaxed to make
+creating the stack faster, as long as the order is not needed otherwise.
+
+Everything is worked out from the template alone, without asking AWS.
+"""
+
+import argparse
+import json
+import re
+import sys
+
+from .diff import references
+from .utils import error_lines, load_template
+
+
+# Rough number of seconds it takes to create a resource, by resource type
+DURATIONS = {
+    'AWS::ApplicationAutoScaling::ScalableTarget': 30,
+    'AWS::ApplicationAutoScaling::ScalingPolicy': 5,
+    'AWS::AutoScaling::AutoScalingGroup': 60,
+    'AWS::AutoScaling::LaunchConfiguration': 5,
+    'AWS::AutoScaling::WarmPool': 30,
+    'AWS::CodeBuild::Project': 10,
+    'AWS::CodePipeline::Pipeline': 15,
+    'AWS::CodePipeline::Webhook': 10,
+    'AWS::EC2::InternetGateway': 15,
+    'AWS::EC2::LaunchTemplate': 5,
+    'AWS::EC2::Route': 30,
+    'AWS::EC2::RouteTable': 10,
+    'AWS::EC2::SecurityGroup': 10,
+    'AWS::EC2::Subnet': 10,
+    'AWS::EC2::SubnetRouteTableAssociation': 5,
+    'AWS::EC2::VPC': 15,
+    'AWS::EC2::VPCGatewayAttachment': 15,
+    'AWS::ECS::CapacityProvider': 10,
+    'AWS::ECS::Cluster': 10,
+    'AWS::ECS::ClusterCapacityProviderAssociations': 10,
+    'AWS::ECS::Service': 120,
+    'AWS::ECS::TaskDefinition': 5,
+    'AWS::ElasticLoadBalancingV2::Listener': 5,
+    'AWS::ElasticLoadBalancingV2::ListenerRule': 5,
+    'AWS::ElasticLoadBalancingV2::LoadBalancer': 180,
+    'AWS::ElasticLoadBalancingV2::TargetGroup': 15,
+    'AWS::IAM::InstanceProfile': 120,
+    'AWS::IAM::Role': 20,
+    'AWS::Logs::LogGroup': 5,
+    'AWS::S3::Bucket': 20,
+}
+
+# For any other type of resource
+DEFAULT_DURATION = 30
+
+# Rough number of seconds hosts take to boot and signal that they are ready,
+# added to the resources that wait for signals
+SIGNAL_DURATION = 300
+
+ISO_DURATION = re.compile(
+    r'PT(?:(\d+)H)?(?:(\d+)M)?(?:(\d+)S)?$')
+
+
+def seconds(duration):
+    """Parse a duration like PT15M, as creation policies give them."""
+    match = ISO_DURATION.match(duration)
+    if not match:
+        raise ValueError(f'{duration} is not a duration')
+    hours, minutes, secs = (int(group or 0) for group in match.groups())
+    return hours * 3600 + minutes * 60 + secs
+
+
+def dependencies(resources):
+    """Map every resource to its dependencies, and those to whether they
+    are only named in DependsOn.
+    """
+    graph = {}
+    for name, resource in resources.items():
+        referred = {
+            target
+            for key, value in resource.items()
+            if key not in ('Type', 'DependsOn')
+            for _, target in references({key: value})
+            if target in resources
+        }
+
+        depends_on = resource.get('DependsOn', [])
+        if not isinstance(depends_on, list):
+            depends_on = [depends_on]
+
+        edges = {target: False for target in referred}
+        for target in depends_on:
+            if target in resources:
+                edges.setdefault(target, True)
+        graph[name] = edges
+    return graph
+
+
+def durations(resources, table=None, worst_case=False):
+    """Estimate the seconds creating every resource takes.
+
+    The table overrides the default estimates by resource type or by the
+    name of a resource. Resources waiting for signals take SIGNAL_DURATION
+    longer, or as long as they wait at most in the worst case.
+    """
+    table = table or {}
+    estimates = {}
+    for name, resource in resources.items():
+        resource_type = resource.get('Type')
+        estimate = table.get(
+            name, table.get(resource_type,
+                            DURATIONS.get(resource_type, DEFAULT_DURATION)))
+
+        signal = resource.get('CreationPolicy', {}).get('ResourceSignal')
+        if signal and name not in table:
+            timeout = seconds(signal.get('Timeout', 'PT5M'))
+            estimate += timeout if worst_case else min(
+                SIGNAL_DURATION, timeout)
+
+        estimates[name] = estimate
+    return estimates
+
+
+def schedule(graph, estimates, dropped=frozenset()):
+    """Return the earliest start and finish of every resource.
+
+    Dependencies in dropped, as (resource, dependency) pairs, are ignored.
+    """
+    waiting = {}
+    dependents = {name: [] for name in graph}
+    for name, edges in graph.items():
+        waiting[name] = 0
+        for target in edges:
+            if (name, target) not in dropped:
+                waiting[name] += 1
+                dependents[target].append(name)
+
+    start, finish = {}, {}
+    ready = sorted(name for name, count in waiting.items() if not count)
+    while ready:
+        name = ready.pop()
+        start[name] = max(
+            (finish[target] for target in graph[name]
+             if (name, target) not in dropped),
+            default=0,
+        )
+        finish[name] = start[name] + estimates[name]
+        for dependent in dependents[name]:
+            waiting[dependent] -= 1
+            if not waiting[dependent]:
+                ready.append(dependent)
+
+    if len(finish) < len(graph):
+        circular = sorted(name for name in graph if name not in finish)
+        raise ValueError(
+            f'circular dependencies between {", ".join(circular)}')
+    return start, finish
+
+
+def critical_path(graph, start, finish):
+    """Return the chain of resources that finishes last, first one first."""
+    name = max(finish, key=lambda name: (finish[name], name))
+    path = [name]
+    while graph[name]:
+        name = max(graph[name], key=lambda target: (finish[target], target))
+        if finish[name] < start[path[-1]]:
+            break
+        path.append(name)
+    return path[::-1]
+
+
+def parallelism(start, finish):
+    """Return the most resources created at once, and since when."""
+    # Resources finishing at a time are done before others start then
+    events = sorted(
+        [(time, 1) for time in start.values()]
+        + [(time, -1) for time in finish.values()]
+    )
+    count, peak, peak_time = 0, 0, 0
+    for time, change in events:
+        count += change
+        if count > peak:
+            peak, peak_time = count, time
+    return peak, peak_time
+
+
+def relaxable(resources, graph, estimates, total):
+    """Find the DependsOn entries that make creating the stack slower.
+
+    Entries are grouped by the types of the resources on both ends, since
+    every service usually has the same ones. Returns the groups that would
+    shorten the creation if they were dropped, with the seconds saved.
+    """
+    groups = {}
+    for name, edges in graph.items():
+        for target, explicit in edges.items():
+            if explicit:
+                key = (resources[name].get('Type'),
+                       resources[target].get('Type'))
+                groups.setdefault(key, set()).add((name, target))
+
+    savings = []
+    for key, edges in groups.items():
+        _, finish = schedule(graph, estimates, frozenset(edges))
+        saved = total - max(finish.values(), default=0)
+        if saved > 0:
+            savings.append((saved, key, len(edges)))
+    return sorted(savings, key=lambda saving: (-saving[0], saving[1]))
+
+
+def format_time(secs):
+    minutes, secs = divmod(round(secs), 60)
+    return f'{minutes}m{secs:02d}s' if minutes else f'{secs}s'
+
+
+def report(resources, graph, estimates, critical=False, out=sys.stdout):
+    start, finish = schedule(graph, estimates)
+    total = max(finish.values(), default=0)
+    peak, peak_time = parallelism(start, finish)
+
+    out.write(f'{len(resources)} resources, created in about'
+              f' {format_time(total)}\n')
+    out.write(f'at most {peak} resources created at once, after'
+              f' {format_time(peak_time)}\n\n')
+
+    if critical:
+        names = critical_path(graph, start, finish)
+        out.write('critical path:\n')
+    else:
+        names = sorted(resources, key=lambda name: (start[name], name))
+    for name in names:
+        out.write(f'{round(start[name]):>6} {round(finish[name]):>6}  {name}'
+                  f' ({resources[name].get("Type")})\n')
+
+    if not critical:
+        return
+
+    savings = relaxable(resources, graph, estimates, total)
+    out.write('\nDependsOn entries that could be relaxed:\n')
+    for saved, (dependent, dependency), count in savings:
+        out.write(f'  {dependent} -> {dependency} ({count}):'
+                  f' {format_time(saved)} faster\n')
+    if not savings:
+        out.write('  none\n')
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        prog='sierra plan',
+        description=__doc__,
+        formatter_class=argparse.RawDescriptionHelpFormatter,
+    )
+    parser.add_argument('file', nargs='?', default='Sierrafile',
+                        metavar='FILE',
+                        help='a template or Sierrafile')
+    parser.add_argument('--critical-path', action='store_true',
+                        help='only list the resources on the critical path,'
+                             ' and the DependsOn entries on it that could be'
+                             ' relaxed')
+    parser.add_argument('--durations', type=str, metavar='FILE',
+                        help='a JSON object of the seconds it takes to'
+                             ' create resources, by type or name')
+    parser.add_argument('--worst-case', action='store_true',
+                        help='wait for signals as long as creation'
+                             ' policies allow')
+
+    args = parser.parse_args(argv)
+
+    table = None
+    if args.durations:
+        try:
+            with open(args.durations) as f:
+                table = json.load(f)
+        except (OSError, ValueError) as e:
+            parser.error(str(e))
+
+    try:
+        resources = load_template(args.file).get('Resources', {})
+    except OSError as e:
+        parser.error(str(e))
+    except ValueError as e:
+        parser.exit(1, error_lines(args.file, e))
+
+    if table is not None and not (
+        isinstance(table, dict)
+        and all(isinstance(value, (int, float))
+                and not isinstance(value, bool) and value >= 0
+                for value in table.values())
+    ):
+        parser.error(f'{args.durations}: must be an object of seconds,'
+                     f' by resource type or name')
+
+    graph = dependencies(resources)
+    estimates = durations(resources, table, args.worst_case)
+
+    try:
+        report(resources, graph, estimates, args.critical_path)
+    except ValueError as e:
+        parser.error(str(e))
+    return 0
@@ -0,0 +1,257 @@
+"""Long-running modes that keep troposphere loaded between builds.
+
+``sierra watch`` regenerates a template whenever its Sierrafile changes.
+``sierra serve`` answers requests on a Unix socket, one JSON object per
+line, for example::
+
+    {"file": "Sierrafile", "format": "json", "compact": true}
+
+The Sierrafile may also be sent inline with ``"sierrafile": {...}``, and
+``"out": "template.yml"`` writes the template into a file instead of
+returning it. Every request is answered with one line of JSON, either
+``{"ok": true, "output": ..., "elapsed_ms": ...}`` or
+``{"ok": false, "error": ..., "elapsed_ms": ...}``. Files are relative to
+the directory the server was started in, and must not be outside of it.
+
+Both modes remember the resources of every service they built, so a
+rebuild only builds the services that changed.
+"""
+
+import argparse
+import io
+import json
+import os
+import signal
+import socketserver
+import stat
+import sys
+import threading
+import time
+from collections import OrderedDict
+
+from .config import parse
+from .output import dump
+from .template import build_template
+from .utils import AttrDict, load
+
+
+MAX_FRAGMENTS = 10000
+
+
+class FragmentMemory(OrderedDict):
+    """In-memory fragment store, forgetting the least recently used first.
+    """
+
+    def __init__(self, max_size=MAX_FRAGMENTS):
+        super().__init__()
+        self.max_size = max_size
+
+    def get(self, key):
+        if key not in self:
+            return None
+        self.move_to_end(key)
+        return self[key]
+
+    def __setitem__(self, key, fragment):
+        super().__setitem__(key, fragment)
+        if len(self) > self.max_size:
+            self.popitem(last=False)
+
+
+class Generator:
+    """Builds templates, reusing the fragments of earlier builds.
+
+    Builds share the fragments, so they take turns.
+    """
+
+    def __init__(self):
+        self.fragments = FragmentMemory()
+        self.lock = threading.Lock()
+
+    def generate(self, raw_sierrafile, out, format='yaml', compact=False):
+        """Build a template into a file, returning the elapsed seconds."""
+        start = time.perf_counter()
+        with self.lock:
+            sierrafile = parse(raw_sierrafile)
+            template = build_template(sierrafile, self.fragments)
+        dump(template, out, format, compact)
+        return time.perf_counter() - start
+
+
+def write_atomically(path, generator, raw_sierrafile, format, compact):
+    tmp_path = path + '.tmp'
+    try:
+        with open(tmp_path, 'w') as out:
+            elapsed = generator.generate(raw_sierrafile, out, format, compact)
+        os.replace(tmp_path, path)
+    finally:
+        if os.path.exists(tmp_path):
+            os.unlink(tmp_path)
+    return elapsed
+
+
+def log(message):
+    print(time.strftime('%H:%M:%S'), message, file=sys.stderr, flush=True)
+
+
+def watch(argv=None):
+    parser = argparse.ArgumentParser(
+        prog='sierra watch',
+        description='Regenerate a template whenever its Sierrafile changes.',
+    )
+    parser.add_argument('-f', '--file', type=str,
+                        default='Sierrafile',
+                        help='specify the Sierrafile to use')
+    parser.add_argument('-o', '--out', type=str,
+                        help='a file to write output into')
+    parser.add_argument('--format', choices=['yaml', 'json'],
+                        default='yaml',
+                        help='specify the output file format')
+    parser.add_argument('--compact', action='store_true',
+                        help='make output compact (only for json)')
+    parser.add_argument('--interval', type=float, default=0.5,
+                        help='seconds between checks for changes')
+
+    args = parser.parse_args(argv)
+
+    generator = Generator()
+    last_seen = None
+
+    try:
+        while True:
+            try:
+                info = os.stat(args.file)
+                seen = (info.st_mtime_ns, info.st_size)
+            except FileNotFoundError:
+                seen = None
+
+            if seen and seen != last_seen:
+                last_seen = seen
+                try:
+                    raw_sierrafile = load(args.file)
+                    if args.out:
+                        elapsed = write_atomically(
+                            args.out, generator, raw_sierrafile,
+                            args.format, args.compact)
+                    else:
+                        elapsed = generator.generate(
+                            raw_sierrafile, sys.stdout,
+                            args.format, args.compact)
+                        sys.stdout.flush()
+                except Exception as e:
+                    log(f'{args.file}: {type(e).__name__}: {e}')
+                else:
+                    log(f'{args.file}: regenerated in'
+                        f' {elapsed * 1000:.1f} ms')
+
+            time.sleep(args.interval)
+    except KeyboardInterrupt:
+        return 0
+
+
+class RequestHandler(socketserver.StreamRequestHandler):
+
+    def handle(self):
+        for line in self.rfile:
+            if not line.strip():
+                continue
+
+            start = time.perf_counter()
+            name = '<inline>'
+            try:
+                request = json.loads(line.decode('utf-8'),
+                                     object_hook=AttrDict)
+                if not isinstance(request, dict):
+                    raise ValueError('a request must be a JSON object')
+                name = request.get('file', name)
+                response = self.generate(request)
+            except Exception as e:
+                response = {'ok': False, 'error': f'{type(e).__name__}: {e}'}
+
+            elapsed = time.perf_counter() - start
+            response['elapsed_ms'] = round(elapsed * 1000, 3)
+
+            self.wfile.write(json.dumps(response).encode('utf-8') + b'\n')
+            self.wfile.flush()
+
+            log(f'{name}: {"ok" if response["ok"] else "failed"}'
+                f' in {elapsed * 1000:.1f} ms')
+
+    def local_path(self, path):
+        """Resolve a path of a request, which must be below the directory
+        the server was started in.
+        """
+        root = self.server.root
+        resolved = os.path.realpath(os.path.join(root, path))
+        if os.path.commonpath([root, resolved]) != root:
+            raise ValueError(f'{path} is outside of {root}')
+        return resolved
+
+    def generate(self, request):
+        if 'sierrafile' in request:
+            raw_sierrafile = request.sierrafile
+        elif 'file' in request:
+            raw_sierrafile = load(self.local_path(request.file))
+        else:
+            raise ValueError('a request needs a file or a sierrafile')
+
+        format = request.get('format', 'yaml')
+        compact = request.get('compact', False)
+        generator = self.server.generator
+
+        if 'out' in request:
+            write_atomically(self.local_path(request.out), generator,
+                             raw_sierrafile, format, compact)
+            return {'ok': True, 'out': request.out}
+
+        out = io.StringIO()
+        generator.generate(raw_sierrafile, out, format, compact)
+        return {'ok': True, 'output': out.getvalue()}
+
+
+def serve(argv=None):
+    parser = argparse.ArgumentParser(
+        prog='sierra serve',
+        description='Answer template requests on a Unix socket.',
+    )
+    parser.add_argument('-s', '--socket', type=str,
+                        default='sierra.sock',
+                        help='the path of the socket to listen on')
+
+    args = parser.parse_args(argv)
+
+    if not hasattr(socketserver, 'UnixStreamServer'):
+        parser.error('Unix sockets are not supported on this platform')
+
+    # Remove the socket left behind by a server that did not shut down
+    if os.path.exists(args.socket):
+        if not stat.S_ISSOCK(os.stat(args.socket).st_mode):
+            parser.error(f'{args.socket} exists and is not a socket')
+        os.unlink(args.socket)
+
+    # Requests read and write files, so only the user running the server
+    # may connect. The socket is created that way rather than changed
+    # afterwards, which would let others connect in the meantime.
+    umask = os.umask(0o177)
+    try:
+        # Every connection gets a thread, so a client keeping its
+        # connection open does not hold up the others
+        server = socketserver.ThreadingUnixStreamServer(
+            args.socket, RequestHandler)
+    finally:
+        os.umask(umask)
+    server.daemon_threads = True
+    server.generator = Generator()
+    server.root = os.path.realpath(os.getcwd())
+    log(f'listening on {args.socket}')
+
+    # Shut down cleanly when stopped by a service manager as well
+    signal.signal(signal.SIGTERM, lambda signum, frame: sys.exit(0))
+
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        return 0
+    finally:
+        server.server_close()
+        os.unlink(args.socket)
@@ -0,0 +1,236 @@
+"""Split a template into nested stacks.
+
+The shared resources (network, cluster, roles, ...) go into one stack and
+the services are spread over further stacks of a fixed number of services.
+A parent template holds all parameters and creates the nested stacks, which
+lets CloudFormation create and update the service stacks in parallel and
+keeps each of them below the resource and size limits of a single stack.
+
+Whenever a nested stack refers to something it does not contain itself, a
+parameter of the same name is added to it, and the parent passes the value
+in: its own parameter, or an output of the stack containing the resource.
+Refs stay unchanged that way, while GetAtts and Sub variables with an
+attribute are rewritten to refer to the new parameter.
+"""
+
+import re
+from collections import OrderedDict
+
+from troposphere import GetAtt, MAX_OUTPUTS, MAX_PARAMETERS, Ref, Template
+from troposphere.cloudformation import Stack
+
+from .template import build_interface, build_services, build_shared
+
+
+PARENT_STACK_NAME = 'ParentStackName'
+
+# ${Name} or ${Name.Attribute} but not the literal ${!Name}
+SUB_VARIABLE = re.compile(r'\$\{([^!}][^}]*)\}')
+
+# cfn-init and cfn-signal have to be given the stack that actually contains
+# the resource, so AWS::StackName is left alone below these keys.
+OWN_STACK_NAME_KEYS = ('Metadata', 'UserData')
+
+
+class NestedStack(object):
+
+    def __init__(self, title, filename, data):
+        self.title = title
+        self.filename = filename
+        self.data = data
+        self.resources = set(data['Resources'])
+        self.inputs = OrderedDict()
+
+    def reference(self, target, attribute=None, stack_name=True):
+        """Return the name to use for a reference within this stack."""
+        if attribute is None:
+            if target == 'AWS::StackName' and stack_name:
+                self.inputs[PARENT_STACK_NAME] = ('AWS::StackName', None)
+                return PARENT_STACK_NAME
+            if target.startswith('AWS::') or target in self.resources:
+                return target
+            name = target
+        else:
+            if target in self.resources:
+                return f'{target}.{attribute}'
+            name = target + attribute.replace('.', '')
+
+        self.inputs[name] = (target, attribute)
+        return name
+
+    def localize(self, node, stack_name=True):
+        """Rewrite references to anything outside of this stack."""
+        if isinstance(node, list):
+            return [self.localize(v, stack_name) for v in node]
+        if not isinstance(node, dict):
+            return node
+
+        if len(node) == 1:
+            (function, value), = node.items()
+
+            if function == 'Ref':
+                return {'Ref': self.reference(value, None, stack_name)}
+
+            if function == 'Fn::GetAtt' and value[0] not in self.resources:
+                return {'Ref': self.reference(*value)}
+
+            if function == 'Fn::Sub':
+                return {'Fn::Sub': self.localize_sub(value, stack_name)}
+
+        return {
+            k: self.localize(v, stack_name and k not in OWN_STACK_NAME_KEYS)
+            for k, v in node.items()
+        }
+
+    def localize_sub(self, value, stack_name):
+        if isinstance(value, list):
+            string, variables = value
+        else:
+            string, variables = value, {}
+
+        def replace(match):
+            variable = match.group(1)
+            if variable in variables:
+                return match.group(0)
+            target, _, attribute = variable.partition('.')
+            name = self.reference(target, attribute or None, stack_name)
+            return '${' + name + '}'
+
+        string = SUB_VARIABLE.sub(replace, string)
+
+        if isinstance(value, list):
+            return [string, self.localize(variables, stack_name)]
+        return string
+
+    def localize_resources(self):
+        for title, resource in self.data['Resources'].items():
+            depends_on = resource.get('DependsOn')
+            if depends_on is not None:
+                if not isinstance(depends_on, list):
+                    depends_on = [depends_on]
+                # Stacks depend on each other through their parameters, so
+                # dependencies on other stacks are satisfied already.
+                depends_on = [d for d in depends_on if d in self.resources]
+                if depends_on:
+                    resource['DependsOn'] = depends_on
+                else:
+                    del resource['DependsOn']
+
+            self.data['Resources'][title] = self.localize(resource)
+
+    def add_output(self, name, target, attribute):
+        outputs = self.data.setdefault('Outputs', {})
+        if name not in outputs:
+            if attribute is None:
+                outputs[name] = {'Value': {'Ref': target}}
+            else:
+                outputs[name] = {'Value': {'Fn::GetAtt': [target, attribute]}}
+        if len(outputs) > MAX_OUTPUTS:
+            raise ValueError(f'{self.filename} needs more than'
+                             f' {MAX_OUTPUTS} outputs')
+
+
+def link(parent, stacks):
+    """Wire the nested stacks to each other through the parent."""
+    for stack in stacks:
+        stack.localize_resources()
+
+    owners = {title: stack for stack in stacks for title in stack.resources}
+
+    for stack in stacks:
+        parameters = {}
+        stack_parameters = {}
+
+        for name, (target, attribute) in stack.inputs.items():
+            if target == 'AWS::StackName':
+                value, definition = Ref(target), {'Type': 'String'}
+            elif target in parent.parameters:
+                value = Ref(target)
+                definition = parameter_definition(parent.parameters[target])
+            elif target in owners:
+                owner = owners[target]
+                owner.add_output(name, target, attribute)
+                value = GetAtt(owner.title, f'Outputs.{name}')
+                definition = {'Type': 'String'}
+            else:
+                raise ValueError(f'{target} is not defined in any stack')
+
+            parameters[name] = value
+            stack_parameters[name] = definition
+
+        if len(stack_parameters) > MAX_PARAMETERS:
+            raise ValueError(f'{stack.filename} needs more than'
+                             f' {MAX_PARAMETERS} parameters')
+
+        if stack_parameters:
+            stack.data['Parameters'] = stack_parameters
+
+        parent.add_resource(Stack(
+            stack.title,
+            TemplateURL=stack.filename,
+            Parameters=parameters,
+        ))
+
+
+def parameter_definition(parameter):
+    """Declare a parameter the parent passes on to a nested stack."""
+    definition = {'Type': parameter.properties['Type']}
+
+    # The parent resolves SSM parameters already, so only the value is
+    # passed on.
+    if definition['Type'].startswith('AWS::SSM::Parameter::Value<'):
+        definition['Type'] = 'String'
+
+    if parameter.properties.get('NoEcho'):
+        definition['NoEcho'] = True
+
+    return definition
+
+
+def build_stacks(sierrafile, shard_size, extension='.yml', fragments=None,
+                 timings=None):
+    """Build a parent template and the templates of its nested stacks.
+
+    Returns the parent template and an OrderedDict mapping the file names
+    of the nested stacks, relative to the parent, to their templates.
+    """
+    parent = Template()
+    parent.add_version('2010-09-09')
+    parent.add_metadata(build_interface(
+        sierrafile.extra_params, sierrafile.cluster.scaling.enable))
+
+    shared_template = Template()
+    shared = build_shared(shared_template, sierrafile, timings)
+
+    # All parameters are declared by the parent and passed on from there
+    parent.parameters = shared_template.parameters
+    shared_template.parameters = {}
+
+    templates = [('SharedStack', 'shared', shared_template)]
+
+    names = list(sierrafile.services)
+    for i in range(0, len(names), shard_size):
+        services = OrderedDict(
+            (name, sierrafile.services[name])
+            for name in names[i:i + shard_size]
+        )
+        template = Template()
+        build_services(
+            template, sierrafile, services, shared, fragments, timings)
+
+        number = i // shard_size + 1
+        templates.append(
+            (f'Services{number}Stack', f'services-{number}', template))
+
+    stacks = []
+    for title, name, template in templates:
+        template.add_version('2010-09-09')
+        stacks.append(
+            NestedStack(title, name + extension, template.to_dict()))
+
+    link(parent, stacks)
+
+    if timings:
+        timings.lap('build.stacks')
+
+    return parent, OrderedDict((s.filename, s.data) for s in stacks)
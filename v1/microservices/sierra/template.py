@@ -1,3 +1,7 @@
+import hashlib
+import json
+from collections import OrderedDict
+
 import awacs.codebuild
 import awacs.ecs
 import awacs.iam
@@ -9,34 +13,118 @@ import troposphere.ecs
 
 from awacs.aws import Allow, PolicyDocument, Statement, Principal
 from troposphere import Base64, GetAZs, GetAtt, Ref, Select, Sub, Tags
-from troposphere import Parameter, Template
-from troposphere.autoscaling import AutoScalingGroup, LaunchConfiguration
+from troposphere import Parameter, Template, encode_to_dict
+from troposphere.applicationautoscaling import (
+    PredefinedMetricSpecification, ScalableTarget, ScalingPolicy,
+    TargetTrackingScalingPolicyConfiguration)
+from troposphere.autoscaling import (
+    LaunchConfiguration, LaunchTemplateSpecification)
 from troposphere.codebuild import Artifacts, Environment, Project, Source
 from troposphere.codepipeline import (
     Actions, ActionTypeId, ArtifactStore, InputArtifacts,
     OutputArtifacts, Pipeline, Stages)
 from troposphere.ec2 import (
-    InternetGateway, Route, RouteTable, SecurityGroup, SecurityGroupRule,
-    Subnet, SubnetRouteTableAssociation, VPC, VPCGatewayAttachment)
+    IamInstanceProfile, InternetGateway, LaunchTemplate, LaunchTemplateData,
+    Route, RouteTable, SecurityGroup, SecurityGroupRule, Subnet,
+    SubnetRouteTableAssociation, VPC, VPCGatewayAttachment)
 from troposphere.ecs import (
-    Cluster, ContainerDefinition, Service, TaskDefinition,
+    AwsvpcConfiguration, Cluster, ContainerDefinition,
+    DeploymentConfiguration, NetworkConfiguration,
+    PlacementConstraint, PlacementStrategy, Service, TaskDefinition,
     PortMapping, LogConfiguration)
 from troposphere.elasticloadbalancingv2 import (
-    Action, Listener, LoadBalancer, TargetGroup)
+    Certificate, Condition, Listener, ListenerRule, LoadBalancer,
+    TargetGroup, TargetGroupAttribute)
 from troposphere.policies import (
     CreationPolicy, UpdatePolicy, ResourceSignal, AutoScalingRollingUpdate)
 from troposphere.iam import InstanceProfile, Policy, Role
 from troposphere.s3 import Bucket
 from troposphere.logs import LogGroup
 
+from . import autoscaling
+from .autoscaling import (
+    AutoScalingGroup, InstanceReusePolicy, InstancesDistribution,
+    LaunchTemplateOverrides, MixedInstancesPolicy, WarmPool)
+from .cache import tool_version
+from .codebuild import ProjectCache
+from .ecs import (
+    AutoScalingGroupProvider, CapacityProvider, CapacityProviderStrategy,
+    ClusterCapacityProviderAssociations, ManagedScaling)
+from .elasticloadbalancingv2 import Action, FixedResponseConfig
+from .model import (
+    BUILD_CACHE_MODES, PLACEMENT_STRATEGIES, SCALING_METRICS, WARM_POOL_STATES)
 from .utils import AttrDict
 from .webhook import AuthenticationConfiguration, FilterRule, Webhook
 
 
 ELB_NAME = 'ElbLoadBalancer'
 
+# Service deployment properties, by their name in a Sierrafile
+DEPLOYMENT_PROPERTIES = {
+    'min_healthy_percent': 'MinimumHealthyPercent',
+    'max_percent': 'MaximumPercent',
+}
+
+# Target group health check properties, by their name in a Sierrafile
+HEALTH_CHECK_PROPERTIES = {
+    'path': 'HealthCheckPath',
+    'interval': 'HealthCheckIntervalSeconds',
+    'timeout': 'HealthCheckTimeoutSeconds',
+    'healthy': 'HealthyThresholdCount',
+    'unhealthy': 'UnhealthyThresholdCount',
+}
+
+# Options of the awslogs log driver, by their name in a Sierrafile
+LOG_OPTIONS = {
+    'mode': 'mode',
+    'max_buffer_size': 'max-buffer-size',
+    'multiline_pattern': 'awslogs-multiline-pattern',
+    'datetime_format': 'awslogs-datetime-format',
+}
+
+SCALING_ROLE = (
+    'arn:aws:iam::${AWS::AccountId}:role/aws-service-role'
+    '/ecs.application-autoscaling.amazonaws.com'
+    '/AWSServiceRoleForApplicationAutoScaling_ECSService'
+)
+
+
+class CachedResource(object):
+    """A resource that was already rendered into a dict by an earlier build.
+    """
+
+    def __init__(self, title, data):
+        self.title = title
+        self.data = data
+
+    def to_dict(self):
+        return self.data
+
+
+def fragment_key(service, shared):
+    """Hash everything the resources of a service are built from."""
+    references = {k: getattr(v, 'title', v) for k, v in shared.items()}
+    canonical = json.dumps(
+        [
+            service.settings(),
+            encode_to_dict(list(service.env_vars.items())),
+            references,
+            tool_version(),
+        ],
+        sort_keys=True,
+        separators=(',', ':'),
+    )
+    return hashlib.sha256(canonical.encode('utf-8')).hexdigest()
+
+
+def iso_duration(seconds):
+    """Format a number of seconds like PT5M, as update policies want it."""
+    if seconds % 60:
+        return f'PT{seconds}S'
+    return f'PT{seconds // 60}M'
 
-def build_interface(env_vars):
+
+def build_interface(env_vars, cluster_scaling=False):
 
     def clean(d):
         return {k: v for k, v in d.items() if v}
@@ -57,7 +145,10 @@ def build_interface(env_vars):
                 ],
                 'ECS Configuration': [
                     'InstanceType',
-                    'ClusterSize',
+                    *(
+                        ['ClusterMinSize', 'ClusterMaxSize']
+                        if cluster_scaling else ['ClusterSize']
+                    ),
                     'KeyName',
                     'ImageId',
                 ],
@@ -73,13 +164,126 @@ def build_interface(env_vars):
     }
 
 
-def build_template(sierrafile):
+def build_template(sierrafile, fragments=None, timings=None):
+    """Build the template for a parsed Sierrafile.
+
+    If a fragment store is given, the resources of every service are looked
+    up in it by fragment_key() and only built when missing. Any mapping with
+    a get method will do, e.g. a dict or a sierra.cache.FragmentCache.
+    A sierra.timings.Timings records the time spent on every section.
+    """
     template = Template()
 
     template.add_version('2010-09-09')
 
-    template.add_metadata(build_interface(sierrafile.extra_params))
+    template.add_metadata(build_interface(
+        sierrafile.extra_params, sierrafile.cluster.scaling.enable))
+
+    shared = build_shared(template, sierrafile, timings)
+    build_services(template, sierrafile, sierrafile.services, shared,
+                   fragments, timings)
+
+    return template
+
+
+def shared_key(sierrafile):
+    """Serialize everything the shared resources are built from."""
+    build_cache = sierrafile.defaults.pipeline.cache
+    return json.dumps(
+        [
+            sierrafile.extra_params,
+            sierrafile.cluster,
+            sierrafile.load_balancer,
+            build_cache,
+            sierrafile.defaults.logs.retention,
+            any(
+                service.pipeline.enable
+                and service.pipeline.cache == build_cache
+                for service in sierrafile.services.values()
+            ),
+        ],
+        sort_keys=True,
+    )
+
+
+def build_templates(sierrafiles, fragments=None, timings=None):
+    """Build the templates of several Sierrafiles at once.
+
+    Sierrafiles that only differ in their services, like the environments
+    of sierra.overlay, share their parameters and shared resources, which
+    are built and rendered once. Every template starts from a copy of the
+    dicts holding them and only adds the resources of its services, which
+    are looked up in the fragments (a dict by default) like build_template
+    does. Returns the templates by the keys of the Sierrafiles.
+    """
+    fragments = {} if fragments is None else fragments
+    bases = {}
+    templates = OrderedDict()
+
+    for name, sierrafile in sierrafiles.items():
+        key = shared_key(sierrafile)
+        if key not in bases:
+            base = Template()
+            base.add_version('2010-09-09')
+            base.add_metadata(build_interface(
+                sierrafile.extra_params, sierrafile.cluster.scaling.enable))
+            shared = build_shared(base, sierrafile, timings)
+            for title, resource in base.resources.items():
+                base.resources[title] = CachedResource(
+                    title, resource.to_dict())
+            bases[key] = base, shared
+
+        base, shared = bases[key]
+        template = Template(Metadata=base.metadata)
+        template.version = base.version
+        template.parameters = dict(base.parameters)
+        template.resources = dict(base.resources)
+
+        build_services(template, sierrafile, sierrafile.services, shared,
+                       fragments, timings)
+        templates[name] = template
+
+    return templates
+
+
+def build_image_id(bootstrap):
+    """Declare the parameter of the AMI hosts boot from.
+
+    Baked hosts need an AMI with cfn-signal, which the ECS-optimized AMI
+    lacks, so they have no default and the stack cannot be created without
+    naming one.
+    """
+    if bootstrap == 'baked':
+        return Parameter(
+            'ImageId',
+            Type='AWS::SSM::Parameter::Value<AWS::EC2::Image::Id>',
+            Description=(
+              'An SSM parameter that resolves to a valid AMI ID.'
+              ' This is the AMI that will be used to create ECS hosts.'
+              ' It must have the ECS agent and /opt/aws/bin/cfn-signal.'
+            ),
+        )
+
+    return Parameter(
+        'ImageId',
+        Type='AWS::SSM::Parameter::Value<AWS::EC2::Image::Id>',
+        Default=(
+            '/aws/service/ecs/optimized-ami'
+            '/amazon-linux/recommended/image_id'
+        ),
+        Description=(
+          'An SSM parameter that resolves to a valid AMI ID.'
+          ' This is the AMI that will be used to create ECS hosts.'
+          ' The default is the current recommended ECS-optimized AMI.'
+        ),
+    )
+
+
+def build_shared(template, sierrafile, timings=None):
+    """Add the parameters and the resources shared by all services.
 
+    Returns the resources that the services refer to.
+    """
     parameters = AttrDict(
 
         # Network Parameters
@@ -102,11 +306,6 @@ def build_template(sierrafile):
 
         # ECS Parameters
 
-        cluster_size=template.add_parameter(Parameter(
-            'ClusterSize',
-            Type='Number',
-            Default=2,
-        )),
         instance_type=template.add_parameter(Parameter(
             'InstanceType',
             Type='String',
@@ -116,19 +315,8 @@ def build_template(sierrafile):
             'KeyName',
             Type='AWS::EC2::KeyPair::KeyName',
         )),
-        image_id=template.add_parameter(Parameter(
-            'ImageId',
-            Type='AWS::SSM::Parameter::Value<AWS::EC2::Image::Id>',
-            Default=(
-                '/aws/service/ecs/optimized-ami'
-                '/amazon-linux/recommended/image_id'
-            ),
-            Description=(
-              'An SSM parameter that resolves to a valid AMI ID.'
-              ' This is the AMI that will be used to create ECS hosts.'
-              ' The default is the current recommended ECS-optimized AMI.'
-            )
-        )),
+        image_id=template.add_parameter(build_image_id(
+            sierrafile.cluster.bootstrap)),
 
         # Other Parameters
 
@@ -139,6 +327,26 @@ def build_template(sierrafile):
         )),
     )
 
+    cluster_scaling = sierrafile.cluster.scaling
+
+    if cluster_scaling.enable:
+        parameters.cluster_min_size = template.add_parameter(Parameter(
+            'ClusterMinSize',
+            Type='Number',
+            Default=cluster_scaling.min,
+        ))
+        parameters.cluster_max_size = template.add_parameter(Parameter(
+            'ClusterMaxSize',
+            Type='Number',
+            Default=cluster_scaling.max,
+        ))
+    else:
+        parameters.cluster_size = template.add_parameter(Parameter(
+            'ClusterSize',
+            Type='Number',
+            Default=2,
+        ))
+
     # Environment Variable Parameters
 
     for env_var_param, env_var_name in sierrafile.extra_params:
@@ -213,12 +421,23 @@ def build_template(sierrafile):
         SubnetId=Ref(subnet2),
     ))
 
-    elb = template.add_resource(LoadBalancer(
-        ELB_NAME,
-        Name=Sub('${AWS::StackName}-elb'),
-        Type='network',
-        Subnets=[Ref(subnet1), Ref(subnet2)],
-    ))
+    load_balancer = sierrafile.load_balancer
+
+    if load_balancer.type == 'application':
+        elb, listener = build_application_load_balancer(
+            template, load_balancer, network_vpc, [subnet1, subnet2])
+    else:
+        elb = template.add_resource(LoadBalancer(
+            ELB_NAME,
+            Name=Sub('${AWS::StackName}-elb'),
+            Type='network',
+            Subnets=[Ref(subnet1), Ref(subnet2)],
+        ))
+        # Every service gets a listener on its own port instead
+        listener = None
+
+    if timings:
+        timings.lap('build.network')
 
     # # Cluster
 
@@ -258,104 +477,139 @@ def build_template(sierrafile):
     ))
 
     autoscaling_name = 'EcsHostAutoScalingGroup'
-    launch_conf_name = 'EcsHostLaunchConfiguration'
 
-    launch_conf = template.add_resource(LaunchConfiguration(
-        launch_conf_name,
-        ImageId=Ref(parameters.image_id),
-        InstanceType=Ref(parameters.instance_type),
-        IamInstanceProfile=Ref(ecs_host_profile),
-        KeyName=Ref(parameters.key_name),
-        SecurityGroups=[Ref(ecs_host_sg)],
-        UserData=Base64(Sub(
-            '#!/bin/bash\n'
-            'yum install -y aws-cfn-bootstrap\n'
-            '/opt/aws/bin/cfn-init -v'
-            ' --region ${AWS::Region}'
-            ' --stack ${AWS::StackName}'
-            f' --resource {launch_conf_name}\n'
-            '/opt/aws/bin/cfn-signal -e $?'
-            ' --region ${AWS::Region}'
-            ' --stack ${AWS::StackName}'
-            f' --resource {autoscaling_name}\n'
-        )),
-        Metadata={
-            'AWS::CloudFormation::Init': {
-                'config': {
-                    'commands': {
-                        '01_add_instance_to_cluster': {
-                            'command': Sub(
-                                f'echo ECS_CLUSTER=${{{cluster.title}}}'
-                                f' > /etc/ecs/ecs.config'
-                            ),
-                        }
-                    },
-                    'files': {
-                        '/etc/cfn/cfn-hup.conf': {
-                            'mode': 0o400,
-                            'owner': 'root',
-                            'group': 'root',
-                            'content': Sub(
-                                '[main]\n'
-                                'stack=${AWS::StackId}\n'
-                                'region=${AWS::Region}\n'
-                            ),
-                        },
-                        '/etc/cfn/hooks.d/cfn-auto-reloader.conf': {
-                            'content': Sub(
-                                '[cfn-auto-reloader-hook]\n'
-                                'triggers=post.update\n'
-                                'path=Resources.ContainerInstances.Metadata'
-                                '.AWS::CloudFormation::Init\n'
-                                'action=/opt/aws/bin/cfn-init -v'
-                                ' --region ${AWS::Region}'
-                                ' --stack ${AWS::StackName}'
-                                f' --resource {launch_conf_name}\n'
-                            ),
-                        },
-                    },
-                    'services': {
-                        'sysvinit': {
-                            'cfn-hup': {
-                                'enabled': True,
-                                'ensureRunning': True,
-                                'files': [
-                                    '/etc/cfn/cfn-hup.conf',
-                                    '/etc/cfn/hooks.d/cfn-auto-reloader.conf'
-                                ]
-                            }
-                        }
-                    }
-                }
-            }
-        }
-    ))
+    bootstrap = sierrafile.cluster.bootstrap
+    warm_pool = sierrafile.cluster.warm_pool
+    instances = sierrafile.cluster.instances
+
+    # Hosts in a warm pool only join the cluster once they leave the pool
+    ecs_config = [f'ECS_CLUSTER=${{{cluster.title}}}']
+    if warm_pool.enable:
+        ecs_config.append('ECS_WARM_POOLS_CHECK=true')
+    # Spot hosts about to be interrupted move their tasks elsewhere first
+    if (instances.enable and instances.spot_draining
+            and spot_capacity(instances)):
+        ecs_config.append('ECS_ENABLE_SPOT_INSTANCE_DRAINING=true')
+
+    # Mixed instances can only be launched from a launch template
+    if bootstrap == 'baked' or instances.enable:
+        launch_name = 'EcsHostLaunchTemplate'
+    else:
+        launch_name = 'EcsHostLaunchConfiguration'
+
+    user_data = build_user_data(
+        bootstrap, launch_name, autoscaling_name, ecs_config)
+    metadata = None
+    if bootstrap == 'cfn-init':
+        metadata = build_cfn_init(launch_name, ecs_config)
+
+    if launch_name == 'EcsHostLaunchTemplate':
+        launch_template = build_launch_template(
+            template, launch_name, parameters, ecs_host_profile,
+            ecs_host_sg, user_data, metadata)
+        launch_spec = LaunchTemplateSpecification(
+            LaunchTemplateId=Ref(launch_template),
+            Version=GetAtt(launch_template, 'LatestVersionNumber'),
+        )
+        if instances.enable:
+            launch = dict(MixedInstancesPolicy=build_mixed_instances(
+                instances, launch_spec))
+        else:
+            launch = dict(LaunchTemplate=launch_spec)
+    else:
+        launch_conf = build_launch_configuration(
+            template, launch_name, parameters, ecs_host_profile,
+            ecs_host_sg, user_data, metadata)
+        launch = dict(LaunchConfigurationName=Ref(launch_conf))
+
+    host_deployment = sierrafile.cluster.deployment
+
+    if cluster_scaling.enable:
+        # The capacity provider sets the desired capacity
+        sizes = dict(
+            MinSize=Ref(parameters.cluster_min_size),
+            MaxSize=Ref(parameters.cluster_max_size),
+        )
+    else:
+        sizes = dict(
+            DesiredCapacity=Ref(parameters.cluster_size),
+            MinSize=Ref(parameters.cluster_size),
+            MaxSize=Ref(parameters.cluster_size),
+        )
 
     autoscaling_group = template.add_resource(AutoScalingGroup(
         autoscaling_name,
         VPCZoneIdentifier=[Ref(subnet1), Ref(subnet2)],
-        LaunchConfigurationName=Ref(launch_conf),
-        DesiredCapacity=Ref(parameters.cluster_size),
-        MinSize=Ref(parameters.cluster_size),
-        MaxSize=Ref(parameters.cluster_size),
         Tags=[{
             'Key': 'Name',
             'Value': Sub('${AWS::StackName} - ECS Host'),
             'PropagateAtLaunch': True,
         }],
         CreationPolicy=CreationPolicy(
-            ResourceSignal=ResourceSignal(Timeout='PT15M'),
+            ResourceSignal=ResourceSignal(
+                Timeout=iso_duration(host_deployment.signal_timeout),
+            ),
         ),
         UpdatePolicy=UpdatePolicy(
             AutoScalingRollingUpdate=AutoScalingRollingUpdate(
-                MinInstancesInService=1,
-                MaxBatchSize=1,
-                PauseTime='PT5M',
+                MinInstancesInService=host_deployment.min_in_service,
+                MaxBatchSize=host_deployment.batch_size,
+                PauseTime=iso_duration(host_deployment.pause),
                 WaitOnResourceSignals=True,
             ),
         ),
+        **launch,
+        **sizes
     ))
 
+    if warm_pool.enable:
+        pool = dict(
+            AutoScalingGroupName=Ref(autoscaling_group),
+            MinSize=warm_pool.min,
+            PoolState=WARM_POOL_STATES[warm_pool.state],
+        )
+        if warm_pool.max_prepared is not None:
+            pool['MaxGroupPreparedCapacity'] = warm_pool.max_prepared
+        if warm_pool.reuse:
+            pool['InstanceReusePolicy'] = InstanceReusePolicy(
+                ReuseOnScaleIn=True)
+        template.add_resource(WarmPool('EcsHostWarmPool', **pool))
+
+    # With a capacity provider, tasks that do not fit on the hosts make the
+    # cluster scale out, and hosts without tasks let it scale in.
+    capacity_providers = None
+    if cluster_scaling.enable:
+        managed_scaling = dict(
+            Status='ENABLED',
+            TargetCapacity=cluster_scaling.target,
+        )
+        if cluster_scaling.step is not None:
+            managed_scaling['MaximumScalingStepSize'] = cluster_scaling.step
+
+        capacity_provider = template.add_resource(CapacityProvider(
+            'EcsCapacityProvider',
+            AutoScalingGroupProvider=AutoScalingGroupProvider(
+                AutoScalingGroupArn=Ref(autoscaling_group),
+                ManagedScaling=ManagedScaling(**managed_scaling),
+                ManagedTerminationProtection='DISABLED',
+            ),
+        ))
+
+        capacity_providers = template.add_resource(
+            ClusterCapacityProviderAssociations(
+                'EcsClusterCapacityProviders',
+                Cluster=Ref(cluster),
+                CapacityProviders=[Ref(capacity_provider)],
+                DefaultCapacityProviderStrategy=[CapacityProviderStrategy(
+                    CapacityProvider=Ref(capacity_provider),
+                    Weight=1,
+                )],
+            )
+        )
+
+    if timings:
+        timings.lap('build.cluster')
+
     # # Services
 
     task_role = template.add_resource(Role(
@@ -484,73 +738,441 @@ def build_template(sierrafile):
         )],
     ))
 
-    log_group = template.add_resource(LogGroup(
-        'LogGroup',
-        LogGroupName=Sub('/ecs/${AWS::StackName}'),
-    ))
+    # Services whose log retention differs from the default get a log group
+    # of their own, the others share this one.
+    log_retention = sierrafile.defaults.logs.retention
+    log_group = template.add_resource(build_log_group(
+        'LogGroup', '/ecs/${AWS::StackName}', log_retention))
 
-    if any(conf.pipeline.enable for conf in sierrafile.services.values()):
-        project = template.add_resource(Project(
+    # Services whose build cache differs from the default get a project of
+    # their own, the others share this one.
+    build_cache = sierrafile.defaults.pipeline.cache
+    project = None
+    if any(
+        service.pipeline.enable and service.pipeline.cache == build_cache
+        for service in sierrafile.services.values()
+    ):
+        project = build_project(
+            template,
             'CodeBuildProject',
-            Name=Sub('${AWS::StackName}-build'),
-            ServiceRole=Ref(codebuild_role),
-            Artifacts=Artifacts(Type='CODEPIPELINE'),
-            Source=Source(Type='CODEPIPELINE'),
-            Environment=Environment(
-                ComputeType='BUILD_GENERAL1_SMALL',
-                Image='aws/codebuild/docker:17.09.0',
-                Type='LINUX_CONTAINER',
-            ),
-        ))
+            '${AWS::StackName}-build',
+            build_cache,
+            codebuild_role,
+            artifact_bucket,
+        )
+
+    if timings:
+        timings.lap('build.shared')
+
+    return AttrDict(
+        github_token=parameters.github_token,
+        network_vpc=network_vpc,
+        subnet1=subnet1,
+        subnet2=subnet2,
+        elb=elb,
+        listener=listener,
+        cluster=cluster,
+        autoscaling_group=autoscaling_group,
+        host_security_group=ecs_host_sg,
+        capacity_providers=capacity_providers,
+        task_role=task_role,
+        artifact_bucket=artifact_bucket,
+        codebuild_role=codebuild_role,
+        codepipeline_role=codepipeline_role,
+        log_group=log_group,
+        log_retention=log_retention,
+        project=project,
+        build_cache=build_cache,
+    )
+
+
+def build_log_group(title, name, retention):
+    log_group = LogGroup(title, LogGroupName=Sub(name))
+    if retention is not None:
+        log_group.RetentionInDays = retention
+    return log_group
+
+
+def build_user_data(bootstrap, launch_name, autoscaling_name, ecs_config):
+    """Return the script hosts run when they boot.
+
+    With cfn-init, the hosts install it and let it configure them from the
+    metadata of their launch configuration or template. A baked AMI already
+    has the ECS agent and cfn-signal, so there is nothing to install or run
+    but joining the cluster.
+    """
+    if bootstrap == 'baked':
+        setup = ''.join(
+            f'echo {line} >> /etc/ecs/ecs.config\n' for line in ecs_config)
+    else:
+        setup = (
+            'yum install -y aws-cfn-bootstrap\n'
+            '/opt/aws/bin/cfn-init -v'
+            ' --region ${AWS::Region}'
+            ' --stack ${AWS::StackName}'
+            f' --resource {launch_name}\n'
+        )
+    return Base64(Sub(
+        '#!/bin/bash\n'
+        + setup
+        + '/opt/aws/bin/cfn-signal -e $?'
+        ' --region ${AWS::Region}'
+        ' --stack ${AWS::StackName}'
+        f' --resource {autoscaling_name}\n'
+    ))
 
-    for name, settings in sierrafile.services.items():
-        task_definition = template.add_resource(TaskDefinition(
-            f'{name}TaskDefinition',
-            RequiresCompatibilities=['EC2'],
-            Cpu=str(settings.container.cpu),
-            Memory=str(settings.container.memory),
-            NetworkMode='bridge',
-            ExecutionRoleArn=Ref(task_role.title),
-            ContainerDefinitions=[
-                ContainerDefinition(
-                    Name=f'{name}',
-                    Image=settings.container.image,
-                    Memory=str(settings.container.memory),
-                    Essential=True,
-                    PortMappings=[
-                        PortMapping(
-                            ContainerPort=settings.container.port,
-                            Protocol='tcp',
+
+def build_cfn_init(launch_name, ecs_config):
+    """Return the metadata cfn-init configures the hosts from."""
+    return {
+        'AWS::CloudFormation::Init': {
+            'config': {
+                'commands': {
+                    '01_add_instance_to_cluster': {
+                        'command': Sub(
+                            f'echo {ecs_config[0]} > /etc/ecs/ecs.config'
+                            + ''.join(
+                                f' && echo {line}'
+                                f' >> /etc/ecs/ecs.config'
+                                for line in ecs_config[1:]
+                            )
                         ),
-                    ],
-                    Environment=[
-                        troposphere.ecs.Environment(Name=k, Value=v)
-                        for k, v in sierrafile.env_vars.items()
-                        if k in settings.get('environment', [])
-                    ],
-                    LogConfiguration=LogConfiguration(
-                        LogDriver='awslogs',
-                        Options={
-                            'awslogs-region': Ref('AWS::Region'),
-                            'awslogs-group': Ref(log_group.title),
-                            'awslogs-stream-prefix': Ref('AWS::StackName'),
-                        },
+                    }
+                },
+                'files': {
+                    '/etc/cfn/cfn-hup.conf': {
+                        'mode': 0o400,
+                        'owner': 'root',
+                        'group': 'root',
+                        'content': Sub(
+                            '[main]\n'
+                            'stack=${AWS::StackId}\n'
+                            'region=${AWS::Region}\n'
+                        ),
+                    },
+                    '/etc/cfn/hooks.d/cfn-auto-reloader.conf': {
+                        'content': Sub(
+                            '[cfn-auto-reloader-hook]\n'
+                            'triggers=post.update\n'
+                            'path=Resources.ContainerInstances.Metadata'
+                            '.AWS::CloudFormation::Init\n'
+                            'action=/opt/aws/bin/cfn-init -v'
+                            ' --region ${AWS::Region}'
+                            ' --stack ${AWS::StackName}'
+                            f' --resource {launch_name}\n'
+                        ),
+                    },
+                },
+                'services': {
+                    'sysvinit': {
+                        'cfn-hup': {
+                            'enabled': True,
+                            'ensureRunning': True,
+                            'files': [
+                                '/etc/cfn/cfn-hup.conf',
+                                '/etc/cfn/hooks.d/cfn-auto-reloader.conf'
+                            ]
+                        }
+                    }
+                }
+            }
+        }
+    }
+
+
+def build_launch_configuration(template, name, parameters, profile,
+                               security_group, user_data, metadata):
+    return template.add_resource(LaunchConfiguration(
+        name,
+        ImageId=Ref(parameters.image_id),
+        InstanceType=Ref(parameters.instance_type),
+        IamInstanceProfile=Ref(profile),
+        KeyName=Ref(parameters.key_name),
+        SecurityGroups=[Ref(security_group)],
+        UserData=user_data,
+        Metadata=metadata,
+    ))
+
+
+def build_launch_template(template, name, parameters, profile,
+                          security_group, user_data, metadata=None):
+    launch_template = LaunchTemplate(
+        name,
+        LaunchTemplateData=LaunchTemplateData(
+            ImageId=Ref(parameters.image_id),
+            InstanceType=Ref(parameters.instance_type),
+            IamInstanceProfile=IamInstanceProfile(
+                Arn=GetAtt(profile, 'Arn'),
+            ),
+            KeyName=Ref(parameters.key_name),
+            SecurityGroupIds=[Ref(security_group)],
+            UserData=user_data,
+        ),
+    )
+    if metadata:
+        launch_template.Metadata = metadata
+    return template.add_resource(launch_template)
+
+
+def spot_capacity(instances):
+    """Whether some of the hosts of a mixed instances group are Spot."""
+    return instances.on_demand_percentage < 100
+
+
+def build_mixed_instances(instances, launch_spec):
+    """Return the policy launching hosts of several instance types, some of
+    them on demand and the rest Spot.
+    """
+    distribution = dict(
+        OnDemandBaseCapacity=instances.on_demand_base,
+        OnDemandPercentageAboveBaseCapacity=instances.on_demand_percentage,
+    )
+    if spot_capacity(instances):
+        distribution['SpotAllocationStrategy'] = instances.spot_strategy
+
+    return MixedInstancesPolicy(
+        InstancesDistribution=InstancesDistribution(**distribution),
+        LaunchTemplate=autoscaling.LaunchTemplate(
+            LaunchTemplateSpecification=launch_spec,
+            Overrides=[
+                LaunchTemplateOverrides(InstanceType=instance_type)
+                for instance_type in instances.types
+            ],
+        ),
+    )
+
+
+def build_application_load_balancer(template, load_balancer, vpc, subnets):
+    """Add an application load balancer with a listener for all services.
+
+    Requests are routed to the services by the rules of their path or host,
+    the rest are answered with a 404.
+    """
+    certificate = load_balancer.certificate
+    port = load_balancer.port or (443 if certificate else 80)
+
+    security_group = template.add_resource(SecurityGroup(
+        'ElbSecurityGroup',
+        GroupDescription=Sub('${AWS::StackName}-elb'),
+        VpcId=Ref(vpc),
+        SecurityGroupIngress=[SecurityGroupRule(
+            CidrIp='0.0.0.0/0',
+            IpProtocol='tcp',
+            FromPort=port,
+            ToPort=port,
+        )]
+    ))
+
+    elb = template.add_resource(LoadBalancer(
+        ELB_NAME,
+        Name=Sub('${AWS::StackName}-elb'),
+        Type='application',
+        SecurityGroups=[Ref(security_group)],
+        Subnets=[Ref(subnet) for subnet in subnets],
+    ))
+
+    listener_properties = {}
+    if certificate:
+        listener_properties['Certificates'] = [
+            Certificate(CertificateArn=certificate),
+        ]
+
+    listener = template.add_resource(Listener(
+        'ElbListener',
+        LoadBalancerArn=Ref(elb),
+        Port=port,
+        Protocol='HTTPS' if certificate else 'HTTP',
+        DefaultActions=[Action(
+            Type='fixed-response',
+            FixedResponseConfig=FixedResponseConfig(
+                ContentType='text/plain',
+                MessageBody='Not Found',
+                StatusCode='404',
+            ),
+        )],
+        **listener_properties
+    ))
+
+    return elb, listener
+
+
+def build_project(template, title, name, cache, role, bucket):
+    """Add a CodeBuild project for building the images of services."""
+    environment = dict(
+        ComputeType='BUILD_GENERAL1_SMALL',
+        Image='aws/codebuild/docker:17.09.0',
+        Type='LINUX_CONTAINER',
+    )
+    cache_properties = {}
+
+    if cache and cache['type'] == 'local':
+        modes = [
+            BUILD_CACHE_MODES[mode]
+            for mode in cache.get('modes', list(BUILD_CACHE_MODES))
+        ]
+        cache_properties['Cache'] = ProjectCache(Type='LOCAL', Modes=modes)
+        # The Docker layer cache only works in privileged mode
+        if BUILD_CACHE_MODES['docker'] in modes:
+            environment['PrivilegedMode'] = True
+    elif cache and cache['type'] == 's3':
+        cache_properties['Cache'] = ProjectCache(
+            Type='S3',
+            Location=cache.get('location') or Sub(
+                f'${{{bucket.title}}}/codebuild-cache/{title}'
+            ),
+        )
+
+    return template.add_resource(Project(
+        title,
+        Name=Sub(name),
+        ServiceRole=Ref(role),
+        Artifacts=Artifacts(Type='CODEPIPELINE'),
+        Source=Source(Type='CODEPIPELINE'),
+        Environment=Environment(**environment),
+        **cache_properties
+    ))
+
+
+def build_services(template, sierrafile, services, shared, fragments=None,
+                   timings=None):
+    """Add the resources of some of the services of a Sierrafile."""
+    for name, service in services.items():
+        build_cached_service(template, service, shared, fragments)
+        if timings:
+            timings.lap_service(name)
+
+
+def build_cached_service(template, service, shared, fragments=None):
+    """Add the resources of a service, from the fragments if possible."""
+    if fragments is None:
+        build_service(template, service, shared)
+        return
+
+    key = fragment_key(service, shared)
+    fragment = fragments.get(key)
+
+    if fragment is None:
+        first = len(template.resources)
+        build_service(template, service, shared)
+        fragment = [
+            (title, template.resources[title].to_dict())
+            for title in list(template.resources)[first:]
+        ]
+        fragments[key] = fragment
+        for title, data in fragment:
+            template.resources[title] = CachedResource(title, data)
+    else:
+        for title, data in fragment:
+            template.add_resource(CachedResource(title, data))
+
+
+def build_service(template, settings, shared):
+    """Add the resources of a single service to the template."""
+    name = settings.name
+    network_mode = settings.container.network_mode
+
+    # In bridge mode, Docker maps the container port to a random host port
+    port_mapping = {}
+    if network_mode != 'bridge':
+        port_mapping['HostPort'] = settings.container.port
+
+    log_group = shared.log_group
+    if settings.logs.retention != shared.log_retention:
+        log_group = template.add_resource(build_log_group(
+            f'{name}LogGroup', f'/ecs/${{AWS::StackName}}/{name}',
+            settings.logs.retention))
+
+    log_options = {
+        'awslogs-region': Ref('AWS::Region'),
+        'awslogs-group': Ref(log_group),
+        'awslogs-stream-prefix': Ref('AWS::StackName'),
+    }
+    for key, option in LOG_OPTIONS.items():
+        value = getattr(settings.logs, key)
+        if value is not None:
+            log_options[option] = str(value)
+
+    task_definition = template.add_resource(TaskDefinition(
+        f'{name}TaskDefinition',
+        RequiresCompatibilities=['EC2'],
+        Cpu=str(settings.container.cpu),
+        Memory=str(settings.container.memory),
+        NetworkMode=network_mode,
+        ExecutionRoleArn=Ref(shared.task_role),
+        ContainerDefinitions=[
+            ContainerDefinition(
+                Name=f'{name}',
+                Image=settings.container.image,
+                Memory=str(settings.container.memory),
+                Essential=True,
+                PortMappings=[
+                    PortMapping(
+                        ContainerPort=settings.container.port,
+                        Protocol='tcp',
+                        **port_mapping
                     ),
+                ],
+                Environment=[
+                    troposphere.ecs.Environment(Name=k, Value=v)
+                    for k, v in settings.env_vars.items()
+                ],
+                LogConfiguration=LogConfiguration(
+                    LogDriver='awslogs',
+                    Options=log_options,
                 ),
-            ],
-        ))
+            ),
+        ],
+    ))
 
-        target_group = template.add_resource(TargetGroup(
-            f'{name}TargetGroup',
-            Port=settings.container.port,
-            Protocol='TCP',
-            VpcId=Ref(network_vpc),
-            Tags=Tags(Name=Sub(f'${{AWS::StackName}}-{name}')),
-        ))
+    routing = settings.load_balancer
+    target_group_properties = {
+        prop: routing.health_check[key]
+        for key, prop in HEALTH_CHECK_PROPERTIES.items()
+        if key in (routing.health_check or {})
+    }
+    # Tasks with network interfaces of their own are registered by IP
+    if network_mode == 'awsvpc':
+        target_group_properties['TargetType'] = 'ip'
+
+    if routing.deregistration_delay is not None:
+        target_group_properties['TargetGroupAttributes'] = [
+            TargetGroupAttribute(
+                Key='deregistration_delay.timeout_seconds',
+                Value=str(routing.deregistration_delay),
+            ),
+        ]
 
+    target_group = template.add_resource(TargetGroup(
+        f'{name}TargetGroup',
+        Port=settings.container.port,
+        Protocol='HTTP' if shared.listener else 'TCP',
+        VpcId=Ref(shared.network_vpc),
+        Tags=Tags(Name=Sub(f'${{AWS::StackName}}-{name}')),
+        **target_group_properties
+    ))
+
+    if shared.listener:
+        conditions = []
+        if routing.path is not None:
+            conditions.append(
+                Condition(Field='path-pattern', Values=[routing.path]))
+        if routing.host is not None:
+            conditions.append(
+                Condition(Field='host-header', Values=[routing.host]))
+
+        listener = template.add_resource(ListenerRule(
+            f'{name}ElbListenerRule',
+            ListenerArn=Ref(shared.listener),
+            Priority=routing.priority,
+            Conditions=conditions,
+            Actions=[
+                Action(TargetGroupArn=Ref(target_group), Type='forward')
+            ],
+        ))
+    else:
         listener = template.add_resource(Listener(
             f'{name}ElbListener',
-            LoadBalancerArn=Ref(elb),
+            LoadBalancerArn=Ref(shared.elb),
             Port=settings.container.port,
             Protocol='TCP',
             DefaultActions=[
@@ -558,115 +1180,233 @@ def build_template(sierrafile):
             ],
         ))
 
-        service = template.add_resource(Service(
-            f'{name}Service',
-            Cluster=Ref(cluster),
-            ServiceName=f'{name}-service',
-            DependsOn=[autoscaling_group.title, listener.title],
-            DesiredCount=settings.container.count,
-            TaskDefinition=Ref(task_definition),
-            LaunchType='EC2',
-            LoadBalancers=[
-                troposphere.ecs.LoadBalancer(
-                    ContainerName=f'{name}',
-                    ContainerPort=settings.container.port,
-                    TargetGroupArn=Ref(target_group),
-                ),
-            ],
-        ))
+    depends_on = [shared.autoscaling_group.title, listener.title]
+    service_properties = {}
+    if shared.capacity_providers:
+        # Without a launch type, the default capacity provider is used
+        depends_on.append(shared.capacity_providers.title)
+    else:
+        service_properties['LaunchType'] = 'EC2'
 
-        if settings.pipeline.enable:
-            pipeline = template.add_resource(Pipeline(
-                f'{name}Pipeline',
-                RoleArn=GetAtt(codepipeline_role, 'Arn'),
-                ArtifactStore=ArtifactStore(
-                    Type='S3',
-                    Location=Ref(artifact_bucket),
-                ),
-                Stages=[
-                    Stages(
+    if network_mode == 'awsvpc':
+        service_properties['NetworkConfiguration'] = NetworkConfiguration(
+            AwsvpcConfiguration=AwsvpcConfiguration(
+                Subnets=[Ref(shared.subnet1), Ref(shared.subnet2)],
+                SecurityGroups=[Ref(shared.host_security_group)],
+            ),
+        )
+
+    deployment = {
+        prop: getattr(settings.deployment, key)
+        for key, prop in DEPLOYMENT_PROPERTIES.items()
+        if getattr(settings.deployment, key) is not None
+    }
+    if deployment:
+        service_properties['DeploymentConfiguration'] = (
+            DeploymentConfiguration(**deployment)
+        )
+
+    placement = settings.placement
+
+    if placement.strategy is not None:
+        service_properties['PlacementStrategies'] = [
+            build_placement_strategy(strategy)
+            for strategy in placement.strategy
+        ]
+
+    if placement.constraints is not None:
+        service_properties['PlacementConstraints'] = [
+            PlacementConstraint(**dict(zip(
+                ('Type', 'Expression'), constraint.split(':', 1))))
+            for constraint in placement.constraints
+        ]
+
+    service = template.add_resource(Service(
+        f'{name}Service',
+        Cluster=Ref(shared.cluster),
+        ServiceName=f'{name}-service',
+        DependsOn=depends_on,
+        DesiredCount=settings.container.count,
+        TaskDefinition=Ref(task_definition),
+        LoadBalancers=[
+            troposphere.ecs.LoadBalancer(
+                ContainerName=f'{name}',
+                ContainerPort=settings.container.port,
+                TargetGroupArn=Ref(target_group),
+            ),
+        ],
+        **service_properties
+    ))
+
+    if settings.scaling.enable:
+        build_scaling(template, name, settings, service, target_group, shared)
+
+    if settings.pipeline.enable:
+        project = shared.project
+        if settings.pipeline.cache != shared.build_cache:
+            project = build_project(
+                template,
+                f'{name}CodeBuildProject',
+                f'${{AWS::StackName}}-{name}-build',
+                settings.pipeline.cache,
+                shared.codebuild_role,
+                shared.artifact_bucket,
+            )
+
+        pipeline = template.add_resource(Pipeline(
+            f'{name}Pipeline',
+            RoleArn=GetAtt(shared.codepipeline_role, 'Arn'),
+            ArtifactStore=ArtifactStore(
+                Type='S3',
+                Location=Ref(shared.artifact_bucket),
+            ),
+            Stages=[
+                Stages(
+                    Name='Source',
+                    Actions=[Actions(
                         Name='Source',
-                        Actions=[Actions(
-                            Name='Source',
-                            ActionTypeId=ActionTypeId(
-                                Category='Source',
-                                Owner='ThirdParty',
-                                Version='1',
-                                Provider='GitHub',
-                            ),
-                            OutputArtifacts=[
-                                OutputArtifacts(Name=f'{name}Source'),
-                            ],
-                            RunOrder='1',
-                            Configuration={
-                                'Owner': settings.pipeline.user,
-                                'Repo': settings.pipeline.repo,
-                                'Branch': settings.pipeline.branch,
-                                'OAuthToken': Ref(parameters.github_token),
-                            },
-                        )],
-                    ),
-                    Stages(
+                        ActionTypeId=ActionTypeId(
+                            Category='Source',
+                            Owner='ThirdParty',
+                            Version='1',
+                            Provider='GitHub',
+                        ),
+                        OutputArtifacts=[
+                            OutputArtifacts(Name=f'{name}Source'),
+                        ],
+                        RunOrder='1',
+                        Configuration={
+                            'Owner': settings.pipeline.user,
+                            'Repo': settings.pipeline.repo,
+                            'Branch': settings.pipeline.branch,
+                            'OAuthToken': Ref(shared.github_token),
+                        },
+                    )],
+                ),
+                Stages(
+                    Name='Build',
+                    Actions=[Actions(
                         Name='Build',
-                        Actions=[Actions(
-                            Name='Build',
-                            ActionTypeId=ActionTypeId(
-                                Category='Build',
-                                Owner='AWS',
-                                Version='1',
-                                Provider='CodeBuild',
-                            ),
-                            InputArtifacts=[
-                                InputArtifacts(Name=f'{name}Source'),
-                            ],
-                            OutputArtifacts=[
-                                OutputArtifacts(Name=f'{name}Build'),
-                            ],
-                            RunOrder='1',
-                            Configuration={
-                                'ProjectName': Ref(project),
-                            },
-                        )],
-                    ),
-                    Stages(
+                        ActionTypeId=ActionTypeId(
+                            Category='Build',
+                            Owner='AWS',
+                            Version='1',
+                            Provider='CodeBuild',
+                        ),
+                        InputArtifacts=[
+                            InputArtifacts(Name=f'{name}Source'),
+                        ],
+                        OutputArtifacts=[
+                            OutputArtifacts(Name=f'{name}Build'),
+                        ],
+                        RunOrder='1',
+                        Configuration={
+                            'ProjectName': Ref(project),
+                        },
+                    )],
+                ),
+                Stages(
+                    Name='Deploy',
+                    Actions=[Actions(
                         Name='Deploy',
-                        Actions=[Actions(
-                            Name='Deploy',
-                            ActionTypeId=ActionTypeId(
-                                Category='Deploy',
-                                Owner='AWS',
-                                Version='1',
-                                Provider='ECS',
-                            ),
-                            InputArtifacts=[
-                                InputArtifacts(Name=f'{name}Build')
-                            ],
-                            RunOrder='1',
-                            Configuration={
-                                'ClusterName': Ref(cluster),
-                                'ServiceName': Ref(service),
-                                'FileName': 'image.json',
-                            },
-                        )],
-                    ),
-                ],
-            ))
-
-            template.add_resource(Webhook(
-                f'{name}CodePipelineWebhook',
-                Name=Sub(f'${{AWS::StackName}}-{name}-webhook'),
-                Authentication='GITHUB_HMAC',
-                AuthenticationConfiguration=AuthenticationConfiguration(
-                    SecretToken=Ref(parameters.github_token),
+                        ActionTypeId=ActionTypeId(
+                            Category='Deploy',
+                            Owner='AWS',
+                            Version='1',
+                            Provider='ECS',
+                        ),
+                        InputArtifacts=[
+                            InputArtifacts(Name=f'{name}Build')
+                        ],
+                        RunOrder='1',
+                        Configuration={
+                            'ClusterName': Ref(shared.cluster),
+                            'ServiceName': Ref(service),
+                            'FileName': 'image.json',
+                        },
+                    )],
                 ),
-                Filters=[FilterRule(
-                    JsonPath='$.ref',
-                    MatchEquals=f'refs/heads/{settings.pipeline.branch}'
-                )],
-                TargetAction='Source',
-                TargetPipeline=Ref(pipeline),
-                TargetPipelineVersion=1,
-                RegisterWithThirdParty=True,
-            ))
+            ],
+        ))
 
-    return template
+        template.add_resource(Webhook(
+            f'{name}CodePipelineWebhook',
+            Name=Sub(f'${{AWS::StackName}}-{name}-webhook'),
+            Authentication='GITHUB_HMAC',
+            AuthenticationConfiguration=AuthenticationConfiguration(
+                SecretToken=Ref(shared.github_token),
+            ),
+            Filters=[FilterRule(
+                JsonPath='$.ref',
+                MatchEquals=f'refs/heads/{settings.pipeline.branch}'
+            )],
+            TargetAction='Source',
+            TargetPipeline=Ref(pipeline),
+            TargetPipelineVersion=1,
+            RegisterWithThirdParty=True,
+        ))
+
+
+def build_placement_strategy(strategy):
+    """Turn a strategy like binpack:memory into a PlacementStrategy."""
+    strategy_type, _, field = strategy.partition(':')
+    if not field:
+        return PlacementStrategy(Type=strategy_type)
+    field = PLACEMENT_STRATEGIES[strategy_type].get(field, field)
+    return PlacementStrategy(Type=strategy_type, Field=field)
+
+
+def build_scaling(template, name, settings, service, target_group, shared):
+    """Scale the number of tasks of a service to track its targets."""
+    scaling = settings.scaling
+    cooldown = scaling.cooldown or {}
+
+    scalable_target = template.add_resource(ScalableTarget(
+        f'{name}ScalableTarget',
+        MinCapacity=(
+            settings.container.count if scaling.min is None else scaling.min
+        ),
+        MaxCapacity=scaling.max,
+        ResourceId=Sub(
+            f'service/${{{shared.cluster.title}}}/${{{service.title}.Name}}'
+        ),
+        RoleARN=Sub(SCALING_ROLE),
+        ScalableDimension='ecs:service:DesiredCount',
+        ServiceNamespace='ecs',
+    ))
+
+    for target, metric in SCALING_METRICS.items():
+        if getattr(scaling, target) is None:
+            continue
+
+        metric_properties = {}
+        if target == 'requests':
+            metric_properties['ResourceLabel'] = Sub(
+                f'${{{shared.elb.title}.LoadBalancerFullName}}'
+                f'/${{{target_group.title}.TargetGroupFullName}}'
+            )
+
+        cooldowns = {}
+        if 'in' in cooldown:
+            cooldowns['ScaleInCooldown'] = cooldown['in']
+        if 'out' in cooldown:
+            cooldowns['ScaleOutCooldown'] = cooldown['out']
+
+        template.add_resource(ScalingPolicy(
+            f'{name}{target.capitalize()}ScalingPolicy',
+            PolicyName=Sub(f'${{AWS::StackName}}-{name}-{target}'),
+            PolicyType='TargetTrackingScaling',
+            ScalingTargetId=Ref(scalable_target),
+            TargetTrackingScalingPolicyConfiguration=(
+                TargetTrackingScalingPolicyConfiguration(
+                    PredefinedMetricSpecification=(
+                        PredefinedMetricSpecification(
+                            PredefinedMetricType=metric,
+                            **metric_properties
+                        )
+                    ),
+                    TargetValue=float(getattr(scaling, target)),
+                    **cooldowns
+                )
+            ),
+        ))
@@ -0,0 +1,76 @@
+"""Measure where the time of a generation goes, for ``sierra --timings``.
+
+The report is one JSON object with the seconds spent in every phase, in the
+order they ran, the seconds spent on every service and the number of
+resources, parameters and outputs of the templates and bytes written.
+"""
+
+import json
+import sys
+import time
+from collections import OrderedDict
+
+
+class Timings(object):
+    """A stopwatch recording the time since the previous lap of any phase.
+    """
+
+    def __init__(self):
+        self.start = self.last = time.perf_counter()
+        self.phases = OrderedDict()
+        self.services = OrderedDict()
+        self.counts = OrderedDict(
+            resources=0, parameters=0, outputs=0, bytes=0)
+        self.cached = False
+
+    def lap(self, phase):
+        now = time.perf_counter()
+        self.phases[phase] = self.phases.get(phase, 0) + now - self.last
+        self.last = now
+
+    def lap_service(self, name):
+        """Record the time spent on a service, and on services in total."""
+        self.services[name] = time.perf_counter() - self.last
+        self.lap('build.services')
+
+    def count(self, template):
+        """Add up the sections of a template, or of a template dict."""
+        if isinstance(template, dict):
+            sections = [
+                template.get(key, {})
+                for key in ('Resources', 'Parameters', 'Outputs')
+            ]
+        else:
+            sections = [
+                template.resources, template.parameters, template.outputs,
+            ]
+
+        for name, section in zip(('resources', 'parameters', 'outputs'),
+                                 sections):
+            self.counts[name] += len(section)
+
+    def writer(self, out):
+        return CountingWriter(out, self.counts)
+
+    def report(self, out=sys.stderr):
+        report = OrderedDict(
+            total=self.last - self.start,
+            cached=self.cached,
+            phases=self.phases,
+            services=self.services,
+        )
+        report.update(self.counts)
+        json.dump(report, out, indent=2)
+        out.write('\n')
+
+
+class CountingWriter(object):
+    """Pass writes on to a file, counting the bytes written."""
+
+    def __init__(self, out, counts):
+        self.out = out
+        self.counts = counts
+
+    def write(self, data):
+        self.counts['bytes'] += len(data.encode('utf-8'))
+        return self.out.write(data)
@@ -2,6 +2,8 @@
 
 """
 
+import json
+
 
 class AttrDict(dict):
 
@@ -13,3 +15,55 @@ class AttrDict(dict):
 
     def __setattr__(self, attr, value):
         self[attr] = value
+
+
+def merge(first, *rest):
+    """Merge objects into a new one, the values of the first ones winning.
+    """
+    merged = dict(first)
+    for layer in rest:
+        for k, v in layer.items():
+            if isinstance(v, dict):
+                merged[k] = merge(merged.get(k, {}), v)
+            else:
+                merged.setdefault(k, v)
+    return merged
+
+
+def load(path):
+    """Read the JSON of a Sierrafile, see sierra.config.parse."""
+    with open(path) as f:
+        return json.load(f)
+
+
+def error_lines(path, error):
+    """Prefix every line of an error message with the file it is about."""
+    return ''.join(f'{path}: {line}\n' for line in str(error).splitlines())
+
+
+def load_template(path, fragments=None):
+    """Load a template, or build the template of a Sierrafile.
+
+    A ValueError is raised if the file is neither JSON nor YAML, or holds
+    an invalid Sierrafile.
+    """
+    with open(path) as f:
+        text = f.read()
+
+    try:
+        data = json.loads(text)
+    except ValueError:
+        from cfn_flip import load_yaml
+        from yaml import YAMLError
+        try:
+            # Plain dicts compare regardless of the order of their keys
+            data = json.loads(json.dumps(load_yaml(text)))
+        except YAMLError as e:
+            raise ValueError(f'neither JSON nor YAML: {e}')
+
+    if isinstance(data, dict) and 'Resources' in data:
+        return data
+
+    from .config import parse
+    from .template import build_template
+    return build_template(parse(data), fragments).to_dict()
@@ -0,0 +1,549 @@
+"""Check Sierrafiles for mistakes, for ``sierra validate``.
+
+validate goes through the JSON of a Sierrafile once and returns every
+mistake it finds instead of stopping at the first one, each with the JSON
+path of the value at fault. It only needs the standard library, so checking
+a Sierrafile does not pay for importing troposphere and awacs.
+"""
+
+import argparse
+import json
+import re
+import sys
+from collections import OrderedDict
+
+from .model import (
+    BUILD_CACHE_MODES, BUILD_CACHE_TYPES, CLUSTER_DEFAULTS, DEFAULTS,
+    HOST_BOOTSTRAPS, LOAD_BALANCER_DEFAULTS, LOAD_BALANCER_TYPES,
+    LOG_MODES, LOG_RETENTION_DAYS, NETWORK_MODES, PLACEMENT_CONSTRAINTS,
+    PLACEMENT_STRATEGIES, SCALING_METRICS, SPOT_ALLOCATION_STRATEGIES,
+    WARM_POOL_STATES)
+from .utils import merge
+
+
+# Service names start the titles of their resources, which CloudFormation
+# only allows letters and digits in
+SERVICE_NAME = re.compile(r'[A-Za-z0-9]+')
+
+# A size in bytes as Docker takes them, like 512k or 4m
+BUFFER_SIZE = re.compile(r'\d+(?:[kmg]i?)?b?$', re.IGNORECASE)
+
+
+def validate(raw_sierrafile):
+    """Return the (path, message) of every mistake in a Sierrafile."""
+    errors = []
+
+    if not isinstance(raw_sierrafile, dict):
+        return [('', 'a Sierrafile must be an object')]
+
+    environment = object_at(errors, raw_sierrafile, 'environment', '')
+    for name, value in environment.items():
+        if value is not None and not isinstance(value, str):
+            errors.append((f'environment.{name}',
+                           'must be a string or null'))
+
+    raw_cluster = object_at(errors, raw_sierrafile, 'cluster', '')
+    check_cluster(errors, raw_cluster)
+
+    raw_load_balancer = object_at(
+        errors, raw_sierrafile, 'load_balancer', '')
+    load_balancer = merge(raw_load_balancer, LOAD_BALANCER_DEFAULTS)
+    check_load_balancer(errors, load_balancer)
+    application = load_balancer['type'] == 'application'
+
+    raw_defaults = object_at(errors, raw_sierrafile, 'default', '')
+    check_sections(errors, raw_defaults, 'default')
+
+    if 'services' not in raw_sierrafile:
+        errors.append(('services', 'is required'))
+    raw_services = object_at(errors, raw_sierrafile, 'services', '')
+
+    # The services that took every priority or port of the load balancer
+    taken = {}
+
+    for name, raw_service in raw_services.items():
+        if not isinstance(raw_service, dict):
+            errors.append((f'services.{name}', 'must be an object'))
+            continue
+        check_sections(errors, raw_service, f'services.{name}')
+
+        check_service(errors, name, raw_service, raw_defaults,
+                      environment, application)
+
+        if application:
+            where = locate(name, raw_service, raw_defaults, 'load_balancer')
+            key, value = 'priority', option(
+                raw_service, raw_defaults, 'load_balancer', 'priority')
+        else:
+            where = locate(name, raw_service, raw_defaults, 'container')
+            key, value = 'port', option(
+                raw_service, raw_defaults, 'container', 'port')
+
+        if value is None or not is_int(value):
+            continue
+        if value in taken:
+            errors.append((where(key), f'{key} {value} of the load balancer'
+                                       f' is already taken by {taken[value]}'))
+        else:
+            taken[value] = name
+
+    # Mistakes in the defaults are found once for every service using them
+    return list(OrderedDict.fromkeys(errors))
+
+
+def object_at(errors, parent, key, path):
+    """Return an object in a Sierrafile, or {} if it is missing or wrong."""
+    if key not in parent:
+        return {}
+    value = parent[key]
+    if not isinstance(value, dict):
+        errors.append((join(path, key), 'must be an object'))
+        return {}
+    return value
+
+
+def check_sections(errors, raw_service, path):
+    for key in raw_service:
+        if key != 'environment':
+            object_at(errors, raw_service, key, path)
+
+
+def join(path, key):
+    return f'{path}.{key}' if path else key
+
+
+def option(raw_service, raw_defaults, key, name):
+    """Return an option of a service, falling back on the defaults."""
+    for raw in (raw_service, raw_defaults, DEFAULTS):
+        section = raw.get(key)
+        if isinstance(section, dict) and name in section:
+            return section[name]
+    return None
+
+
+def locate(name, raw_service, raw_defaults, key):
+    """Make a function giving the path of the options of a section.
+
+    Options are found where the service sets them, or in the defaults if
+    only those do.
+    """
+    own = raw_service.get(key)
+    shared = raw_defaults.get(key)
+
+    def where(option):
+        if (not (isinstance(own, dict) and option in own)
+                and isinstance(shared, dict) and option in shared):
+            return f'default.{key}.{option}'
+        return f'services.{name}.{key}.{option}'
+
+    return where
+
+
+def is_int(value):
+    return isinstance(value, int) and not isinstance(value, bool)
+
+
+def check_int(errors, path, value, minimum=None, maximum=None):
+    """Check a whole number, returning whether it is one."""
+    if not is_int(value):
+        errors.append((path, 'must be a whole number'))
+        return False
+
+    if minimum is not None and maximum is not None:
+        if not minimum <= value <= maximum:
+            errors.append(
+                (path, f'must be between {minimum} and {maximum}'))
+    elif minimum is not None and value < minimum:
+        errors.append((path, f'must be at least {minimum}'))
+    return True
+
+
+def check_string(errors, path, value):
+    if value is None:
+        errors.append((path, 'is required'))
+    elif not isinstance(value, str) or not value:
+        errors.append((path, 'must be a non-empty string'))
+
+
+def check_list(errors, path, value):
+    """Check a list of strings, returning it or [] if it is something else.
+    """
+    if value is None:
+        return []
+    if (not isinstance(value, list)
+            or not all(isinstance(item, str) for item in value)):
+        errors.append((path, 'must be a list of strings'))
+        return []
+    return value
+
+
+def check_choice(errors, path, value, choices):
+    if value not in choices:
+        errors.append((path, f'must be one of {", ".join(choices)}'))
+
+
+def check_cluster(errors, raw_cluster):
+    if 'scaling' in raw_cluster:
+        scaling = merge(object_at(errors, raw_cluster, 'scaling', 'cluster'),
+                        CLUSTER_DEFAULTS['scaling'])
+        valid = all([
+            check_int(errors, 'cluster.scaling.min', scaling['min'], 1),
+            check_int(errors, 'cluster.scaling.max', scaling['max'], 1),
+        ])
+        if valid and scaling['min'] > scaling['max']:
+            errors.append(('cluster.scaling.min', 'must not be above max'))
+
+        check_int(errors, 'cluster.scaling.target', scaling['target'], 1, 100)
+        if scaling.get('step') is not None:
+            check_int(errors, 'cluster.scaling.step', scaling['step'], 1)
+
+    deployment = merge(
+        object_at(errors, raw_cluster, 'deployment', 'cluster'),
+        CLUSTER_DEFAULTS['deployment'])
+    # A pause or timeout of zero would fail every update, and CloudFormation
+    # waits for PT1H and PT12H at the most
+    for key, minimum, maximum in (('batch_size', 1, None),
+                                  ('min_in_service', 0, None),
+                                  ('pause', 1, 3600),
+                                  ('signal_timeout', 1, 43200)):
+        check_int(errors, f'cluster.deployment.{key}', deployment[key],
+                  minimum, maximum)
+
+    check_choice(errors, 'cluster.bootstrap',
+                 raw_cluster.get('bootstrap', CLUSTER_DEFAULTS['bootstrap']),
+                 HOST_BOOTSTRAPS)
+
+    if 'instances' in raw_cluster:
+        instances = merge(
+            object_at(errors, raw_cluster, 'instances', 'cluster'),
+            CLUSTER_DEFAULTS['instances'])
+        types = instances.get('types')
+        if types is None:
+            errors.append(('cluster.instances.types', 'is required'))
+        elif types == []:
+            errors.append(('cluster.instances.types',
+                           'must list at least one instance type'))
+        else:
+            check_list(errors, 'cluster.instances.types', types)
+        check_int(errors, 'cluster.instances.on_demand_base',
+                  instances['on_demand_base'], 0)
+        check_int(errors, 'cluster.instances.on_demand_percentage',
+                  instances['on_demand_percentage'], 0, 100)
+        check_choice(errors, 'cluster.instances.spot_strategy',
+                     instances['spot_strategy'], SPOT_ALLOCATION_STRATEGIES)
+        if not isinstance(instances['spot_draining'], bool):
+            errors.append(('cluster.instances.spot_draining',
+                           'must be true or false'))
+
+    # Auto Scaling has no warm pools for mixed instances or Spot instances
+    if 'warm_pool' in raw_cluster and 'instances' in raw_cluster:
+        errors.append(('cluster.warm_pool',
+                       'cannot be used together with cluster.instances'))
+
+    if 'warm_pool' in raw_cluster:
+        warm_pool = merge(
+            object_at(errors, raw_cluster, 'warm_pool', 'cluster'),
+            CLUSTER_DEFAULTS['warm_pool'])
+        check_int(errors, 'cluster.warm_pool.min', warm_pool['min'], 0)
+        if warm_pool.get('max_prepared') is not None:
+            check_int(errors, 'cluster.warm_pool.max_prepared',
+                      warm_pool['max_prepared'], 0)
+        check_choice(errors, 'cluster.warm_pool.state', warm_pool['state'],
+                     WARM_POOL_STATES)
+        if not isinstance(warm_pool['reuse'], bool):
+            errors.append(('cluster.warm_pool.reuse', 'must be true or false'))
+
+
+def check_load_balancer(errors, load_balancer):
+    check_choice(errors, 'load_balancer.type', load_balancer['type'],
+                 LOAD_BALANCER_TYPES)
+
+    if load_balancer.get('port') is not None:
+        check_int(errors, 'load_balancer.port', load_balancer['port'],
+                  1, 65535)
+
+    if load_balancer.get('certificate') is not None:
+        check_string(errors, 'load_balancer.certificate',
+                     load_balancer['certificate'])
+
+
+def check_service(errors, name, raw_service, raw_defaults, environment,
+                  application):
+    if not SERVICE_NAME.fullmatch(name):
+        errors.append((f'services.{name}',
+                       'service names can only have letters and digits'))
+
+    def section(key):
+        return merge(
+            object_at([], raw_service, key, ''),
+            object_at([], raw_defaults, key, ''),
+            DEFAULTS.get(key, {}),
+        )
+
+    def where(key):
+        return locate(name, raw_service, raw_defaults, key)
+
+    container = section('container')
+    check_container(errors, where('container'), container)
+
+    if 'environment' in raw_service:
+        path = f'services.{name}.environment'
+        names = raw_service['environment']
+    else:
+        path = 'default.environment'
+        names = raw_defaults.get('environment', [])
+    for index, env_var in enumerate(check_list(errors, path, names)):
+        if env_var not in environment:
+            errors.append((f'{path}[{index}]',
+                           f'{env_var} is not declared in environment'))
+
+    if 'pipeline' in raw_service:
+        check_pipeline(errors, where('pipeline'), section('pipeline'))
+
+    if 'scaling' in raw_service:
+        check_scaling(errors, where('scaling'), section('scaling'),
+                      container, application)
+
+    check_routing(errors, where('load_balancer'), section('load_balancer'),
+                  application)
+    check_placement(errors, where('placement'), section('placement'))
+    check_deployment(errors, where('deployment'), section('deployment'))
+    check_logs(errors, where('logs'), section('logs'))
+
+
+def check_container(errors, where, container):
+    check_string(errors, where('image'), container.get('image'))
+
+    if container.get('port') is None:
+        errors.append((where('port'), 'is required'))
+    else:
+        check_int(errors, where('port'), container['port'], 1, 65535)
+
+    check_int(errors, where('count'), container['count'], 0)
+    check_int(errors, where('cpu'), container['cpu'], 1)
+    check_int(errors, where('memory'), container['memory'], 1)
+    check_choice(errors, where('network_mode'), container['network_mode'],
+                 NETWORK_MODES)
+
+
+def check_pipeline(errors, where, pipeline):
+    for key in ('user', 'repo', 'branch'):
+        check_string(errors, where(key), pipeline.get(key))
+
+    cache = pipeline.get('cache')
+    if cache is None:
+        return
+    if not isinstance(cache, dict):
+        errors.append((where('cache'), 'must be an object'))
+        return
+
+    path = where('cache')
+    check_choice(errors, f'{path}.type', cache.get('type'), BUILD_CACHE_TYPES)
+    if cache.get('location') is not None:
+        check_string(errors, f'{path}.location', cache['location'])
+    modes = f'{path}.modes'
+    for mode in check_list(errors, modes, cache.get('modes')):
+        if mode not in BUILD_CACHE_MODES:
+            errors.append(
+                (modes, f'must be any of {", ".join(BUILD_CACHE_MODES)}'))
+
+
+def check_scaling(errors, where, scaling, container, application):
+    maximum = scaling.get('max')
+    if maximum is None:
+        errors.append((where('max'), 'is required'))
+        valid = False
+    else:
+        valid = check_int(errors, where('max'), maximum, 1)
+
+    if scaling.get('min') is None:
+        minimum, path = container['count'], where('min')
+    else:
+        minimum, path = scaling['min'], where('min')
+        valid = check_int(errors, path, minimum, 0) and valid
+    if valid and is_int(minimum) and minimum > maximum:
+        errors.append((path, 'must not be above max'))
+
+    targets = [
+        target for target in SCALING_METRICS
+        if scaling.get(target) is not None
+    ]
+    if not targets:
+        errors.append((where('cpu'), f'scaling needs a target for any of'
+                                     f' {", ".join(SCALING_METRICS)}'))
+
+    for target in targets:
+        if target == 'requests':
+            check_int(errors, where(target), scaling[target], 1)
+            # Request counts per target are only known to application load
+            # balancers
+            if not application:
+                errors.append((where(target), 'scaling on requests needs an'
+                                              ' application load balancer'))
+        else:
+            check_int(errors, where(target), scaling[target], 1, 100)
+
+    cooldown = scaling.get('cooldown')
+    if cooldown is None:
+        return
+    if not isinstance(cooldown, dict):
+        errors.append((where('cooldown'), 'must be an object'))
+        return
+    for key in ('in', 'out'):
+        if key in cooldown:
+            check_int(errors, f'{where("cooldown")}.{key}', cooldown[key], 0)
+
+
+def check_routing(errors, where, routing, application):
+    if application:
+        if routing.get('path') is None and routing.get('host') is None:
+            errors.append((where('path'), 'an application load balancer'
+                                          ' needs a path or host to route to'
+                                          ' the service'))
+        for key in ('path', 'host'):
+            if routing.get(key) is not None:
+                check_string(errors, where(key), routing[key])
+        if routing.get('priority') is not None:
+            check_int(errors, where('priority'), routing['priority'],
+                      1, 50000)
+    else:
+        for key in ('path', 'host', 'priority'):
+            if routing.get(key) is not None:
+                errors.append((where(key), 'routing by path or host needs an'
+                                           ' application load balancer'))
+
+    health_check = routing.get('health_check')
+    if isinstance(health_check, dict):
+        path = where('health_check')
+        if 'path' in health_check and not application:
+            errors.append((f'{path}.path', 'health checks of a path need an'
+                                           ' application load balancer'))
+        for key in ('interval', 'timeout', 'healthy', 'unhealthy'):
+            if key in health_check:
+                check_int(errors, f'{path}.{key}', health_check[key], 1)
+    elif health_check is not None:
+        errors.append((where('health_check'), 'must be an object'))
+
+    if routing.get('deregistration_delay') is not None:
+        check_int(errors, where('deregistration_delay'),
+                  routing['deregistration_delay'], 0, 3600)
+
+
+def check_placement(errors, where, placement):
+    path = where('strategy')
+    for strategy in check_list(errors, path, placement.get('strategy')):
+        strategy_type, _, field = strategy.partition(':')
+        if strategy_type not in PLACEMENT_STRATEGIES:
+            errors.append((path, f'must be any of'
+                                 f' {", ".join(PLACEMENT_STRATEGIES)}'))
+            continue
+
+        fields = PLACEMENT_STRATEGIES[strategy_type]
+        if strategy_type == 'random':
+            valid = not field
+        elif strategy_type == 'spread':
+            valid = field in fields or field.startswith('attribute:')
+        else:
+            valid = field in fields
+        if not valid:
+            errors.append(
+                (path, f'{strategy} is not a valid placement strategy'))
+
+    path = where('constraints')
+    for constraint in check_list(errors, path, placement.get('constraints')):
+        constraint_type, _, expression = constraint.partition(':')
+        if constraint_type not in PLACEMENT_CONSTRAINTS:
+            errors.append((path, f'must be any of'
+                                 f' {", ".join(PLACEMENT_CONSTRAINTS)}'))
+        elif (constraint_type == 'memberOf') != bool(expression):
+            errors.append((path, 'only memberOf placement constraints take'
+                                 ' an expression'))
+
+
+def check_deployment(errors, where, deployment):
+    min_healthy = deployment.get('min_healthy_percent')
+    maximum = deployment.get('max_percent')
+
+    valid = True
+    if min_healthy is None:
+        min_healthy = 100
+    else:
+        valid = check_int(errors, where('min_healthy_percent'), min_healthy,
+                          0, 100)
+    if maximum is None:
+        maximum = 200
+    else:
+        valid = check_int(errors, where('max_percent'), maximum) and valid
+
+    # Otherwise no task could ever be replaced
+    if valid and maximum <= min_healthy:
+        errors.append((where('max_percent'),
+                       'must be above min_healthy_percent'))
+
+
+def check_logs(errors, where, logs):
+    mode = logs.get('mode')
+    if mode is not None:
+        check_choice(errors, where('mode'), mode, LOG_MODES)
+
+    buffer_size = logs.get('max_buffer_size')
+    if buffer_size is not None:
+        if not (is_int(buffer_size) and buffer_size > 0
+                or isinstance(buffer_size, str)
+                and BUFFER_SIZE.match(buffer_size)):
+            errors.append((where('max_buffer_size'),
+                           'must be a size in bytes, like 4m'))
+        elif mode != 'non-blocking':
+            errors.append((where('max_buffer_size'),
+                           'only applies to the non-blocking mode'))
+
+    for key in ('multiline_pattern', 'datetime_format'):
+        if logs.get(key) is not None:
+            check_string(errors, where(key), logs[key])
+    # The log driver ignores the pattern when given both
+    if (logs.get('multiline_pattern') is not None
+            and logs.get('datetime_format') is not None):
+        errors.append((where('multiline_pattern'),
+                       'cannot be set together with datetime_format'))
+
+    retention = logs.get('retention')
+    if retention is not None and not (is_int(retention)
+                                      and retention in LOG_RETENTION_DAYS):
+        errors.append((where('retention'),
+                       'must be a number of days CloudWatch Logs allows,'
+                       ' like 7, 30 or 365'))
+
+
+def format_error(path, message):
+    return f'{path}: {message}' if path else message
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        prog='sierra validate',
+        description='Check Sierrafiles for mistakes, without generating'
+                    ' anything.')
+    parser.add_argument('files', nargs='*', metavar='FILE',
+                        default=['Sierrafile'],
+                        help='the Sierrafiles to check')
+
+    args = parser.parse_args(argv)
+    failures = 0
+
+    for path in args.files:
+        try:
+            with open(path) as f:
+                errors = validate(json.load(f))
+        except OSError as e:
+            errors = [('', e.strerror)]
+        except ValueError as e:
+            errors = [('', f'invalid JSON: {e}')]
+
+        if errors:
+            failures += 1
+            for error in errors:
+                print(f'{path}: {format_error(*error)}', file=sys.stderr)
+        else:
+            print(f'{path}: ok', file=sys.stderr)
+
+    return 1 if failures else 0
@@ -0,0 +1,101 @@
+import os
+import sys
+from collections import OrderedDict
+
+import pytest
+import troposphere
+
+from sierra import cache as cache_module
+from sierra.cache import (Cache, FragmentCache, cache_key,
+                          dependency_version, tool_version)
+
+
+@pytest.fixture
+def fresh_version():
+    tool_version.cache_clear()
+    yield
+    tool_version.cache_clear()
+
+
+def test_key_ignores_key_order():
+    first = OrderedDict([('services', {}), ('environment', {'A': 'a'})])
+    second = OrderedDict([('environment', {'A': 'a'}), ('services', {})])
+    assert cache_key(first, format='yaml') == cache_key(second, format='yaml')
+
+
+def test_key_depends_on_sierrafile(sierrafile):
+    key = cache_key(sierrafile, format='yaml')
+    sierrafile['services']['CaliberZuul']['container']['port'] = 9998
+    assert cache_key(sierrafile, format='yaml') != key
+
+
+def test_key_depends_on_every_option(sierrafile):
+    options = dict(format='json', compact=False, minify=False)
+    key = cache_key(sierrafile, **options)
+    for name, value in (('format', 'yaml'), ('compact', True),
+                        ('minify', True)):
+        assert cache_key(sierrafile, **dict(options, **{name: value})) != key
+
+
+def test_dependency_version():
+    assert dependency_version('troposphere') == troposphere.__version__
+    assert dependency_version('no-such-distribution') is None
+
+
+def test_key_depends_on_dependencies(sierrafile, monkeypatch, fresh_version):
+    key = cache_key(sierrafile, format='yaml')
+    monkeypatch.setattr(cache_module, 'dependency_version', lambda name: '0')
+    tool_version.cache_clear()
+    assert cache_key(sierrafile, format='yaml') != key
+
+
+def test_frozen_key_depends_on_executable(sierrafile, tmp_path, monkeypatch,
+                                          fresh_version):
+    executable = tmp_path / 'sierra'
+    executable.write_text('old')
+    monkeypatch.setattr(sys, 'frozen', True, raising=False)
+    monkeypatch.setattr(sys, 'executable', str(executable))
+    key = cache_key(sierrafile, format='yaml')
+
+    executable.write_text('new build')
+    os.utime(str(executable), (0, 0))
+    tool_version.cache_clear()
+    assert cache_key(sierrafile, format='yaml') != key
+
+
+def test_store_and_open(tmp_path):
+    cache = Cache(str(tmp_path))
+    assert cache.open('key') is None
+
+    with cache.store('key') as f:
+        f.write('template')
+    with cache.open('key') as f:
+        assert f.read() == 'template'
+
+
+def test_failed_store_leaves_nothing(tmp_path):
+    cache = Cache(str(tmp_path))
+    try:
+        with cache.store('key') as f:
+            f.write('half a template')
+            raise RuntimeError
+    except RuntimeError:
+        pass
+    assert cache.open('key') is None
+    assert list(tmp_path.iterdir()) == []
+
+
+def test_evicts_least_recently_used(tmp_path):
+    cache = Cache(str(tmp_path), max_size=25)
+    for key in ('a', 'b', 'c'):
+        with cache.store(key) as f:
+            f.write('x' * 10)
+    assert cache.open('a') is None
+    assert cache.open('c') is not None
+
+
+def test_fragments(tmp_path):
+    fragments = FragmentCache(str(tmp_path))
+    assert fragments.get('key') is None
+    fragments['key'] = [['Title', {'Type': 'AWS::S3::Bucket'}]]
+    assert fragments.get('key') == [['Title', {'Type': 'AWS::S3::Bucket'}]]
@@ -0,0 +1,88 @@
+import copy
+
+from sierra.diff import diff, references
+
+
+def resources(**resources):
+    return {'Resources': resources}
+
+
+BUCKET = {'Type': 'AWS::S3::Bucket', 'Properties': {}}
+
+TASK = {
+    'Type': 'AWS::ECS::TaskDefinition',
+    'Properties': {'ContainerDefinitions': [{'Image': 'users:1'}]},
+}
+
+SERVICE = {
+    'Type': 'AWS::ECS::Service',
+    'Properties': {
+        'DesiredCount': 1,
+        'TaskDefinition': {'Ref': 'UsersTaskDefinition'},
+    },
+}
+
+
+def test_no_changes():
+    template = resources(Bucket=BUCKET)
+    changes = diff(template, copy.deepcopy(template))
+    assert all(not section for section in changes.values())
+
+
+def test_added_and_removed():
+    changes = diff(resources(Old=BUCKET), resources(New=BUCKET))['Resources']
+    assert changes['Old'].action == '-'
+    assert changes['New'].action == '+'
+
+
+def test_modified_property():
+    new = copy.deepcopy(SERVICE)
+    new['Properties']['DesiredCount'] = 2
+    change = diff(resources(UsersService=SERVICE),
+                  resources(UsersService=new))['Resources']['UsersService']
+    assert change.action == '~'
+    assert not change.replacement
+    assert [value.path for value in change.values] == ['DesiredCount']
+
+
+def test_replacement_spreads_to_referrers():
+    new_task = copy.deepcopy(TASK)
+    new_task['Properties']['ContainerDefinitions'][0]['Image'] = 'users:2'
+
+    changes = diff(
+        resources(UsersTaskDefinition=TASK, UsersService=SERVICE),
+        resources(UsersTaskDefinition=new_task, UsersService=SERVICE),
+    )['Resources']
+
+    assert changes['UsersTaskDefinition'].replacement
+    service = changes['UsersService']
+    assert not service.replacement
+    assert [(value.path, value.cause) for value in service.values] == [
+        ('TaskDefinition', 'UsersTaskDefinition'),
+    ]
+
+
+def test_replacing_property():
+    group = {
+        'Type': 'AWS::ElasticLoadBalancingV2::TargetGroup',
+        'Properties': {'Port': 80},
+    }
+    new = copy.deepcopy(group)
+    new['Properties']['Port'] = 8080
+    change = diff(resources(Group=group),
+                  resources(Group=new))['Resources']['Group']
+    assert change.replacement
+
+
+def test_references():
+    properties = {
+        'Role': {'Fn::GetAtt': ['Role', 'Arn']},
+        'Items': [{'Ref': 'Bucket'}, {'Ref': 'AWS::Region'}],
+        'Name': {'Fn::Sub': '${Cluster}-${AWS::StackName} ${!Literal}'},
+    }
+    assert sorted(references(properties)) == [
+        ('Items[0]', 'Bucket'),
+        ('Items[1]', 'AWS::Region'),
+        ('Name', 'Cluster'),
+        ('Role', 'Role'),
+    ]
@@ -0,0 +1,50 @@
+import io
+import json
+
+from sierra.config import parse
+from sierra.minify import Savings, minify
+from sierra.output import dump
+from sierra.template import build_template
+
+
+def build(raw):
+    return build_template(parse(raw)).to_dict()
+
+
+def test_repeated_environment_values_are_mapped(sierrafile):
+    sierrafile['default']['environment'].append('CALIBER_CONFIG_GIT_URI')
+    uri = sierrafile['environment']['CALIBER_CONFIG_GIT_URI']
+    data = minify(build(sierrafile), 'json')
+    assert list(data['Mappings']['S'].values()) == [{'v': uri}]
+    assert uri not in json.dumps(data['Resources'])
+
+
+def test_other_properties_are_not_mapped():
+    name = 'a-rather-long-name-repeated-by-every-resource'
+    properties = {
+        'ContainerDefinitions': [{'Name': name, 'Image': name}],
+        'Family': name,
+    }
+    data = minify({'Resources': {
+        f'Task{i}': {
+            'Type': 'AWS::ECS::TaskDefinition',
+            'Properties': properties,
+        }
+        for i in range(5)
+    }}, 'json')
+    assert 'Mappings' not in data
+
+
+def test_yaml_is_not_mapped(sierrafile):
+    sierrafile['default']['environment'].append('CALIBER_CONFIG_GIT_URI')
+    assert 'S' not in minify(build(sierrafile), 'yaml').get('Mappings', {})
+
+
+def test_savings_are_counted_against_compact_output(sierrafile):
+    template = build(sierrafile)
+    compact = io.StringIO()
+    dump(template, compact, 'json', True)
+
+    savings = Savings('json')
+    savings.minify(template)
+    assert savings.before == len(compact.getvalue().encode('utf-8'))
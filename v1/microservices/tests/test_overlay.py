@@ -0,0 +1,43 @@
+from sierra.overlay import DELETE, apply, environment_name
+
+
+def test_merges_objects():
+    base = {'default': {'container': {'cpu': 256, 'memory': 1024}}}
+    overlay = {'default': {'container': {'memory': 2048}}}
+    assert apply(base, overlay) == {
+        'default': {'container': {'cpu': 256, 'memory': 2048}},
+    }
+
+
+def test_replaces_other_values():
+    base = {'default': {'environment': ['A', 'B']}}
+    assert apply(base, {'default': {'environment': ['C']}}) == {
+        'default': {'environment': ['C']},
+    }
+
+
+def test_null_makes_a_stack_parameter():
+    base = {'environment': {'PASSWORD': 'secret'}}
+    assert apply(base, {'environment': {'PASSWORD': None}}) == {
+        'environment': {'PASSWORD': None},
+    }
+
+
+def test_deletes():
+    base = {'services': {'Users': {}, 'Debug': {}}}
+    assert apply(base, {'services': {'Debug': DELETE}}) == {
+        'services': {'Users': {}},
+    }
+    assert apply(base, {'services': {'Missing': DELETE}}) == base
+
+
+def test_leaves_base_alone():
+    base = {'services': {'Users': {'container': {'count': 1}}}}
+    apply(base, {'services': {'Users': {'container': {'count': 4}}}})
+    assert base == {'services': {'Users': {'container': {'count': 1}}}}
+
+
+def test_environment_name():
+    assert environment_name('environments/prod.json') == 'prod'
+    assert environment_name('Sierrafile.stage') == 'stage'
+    assert environment_name('dev') == 'dev'
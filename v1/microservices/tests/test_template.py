@@ -0,0 +1,36 @@
+import io
+
+from sierra.config import parse
+from sierra.output import dump
+from sierra.template import build_template
+
+
+def build(raw, fragments=None, format='yaml'):
+    out = io.StringIO()
+    dump(build_template(parse(raw), fragments), out, format)
+    return out.getvalue()
+
+
+def test_fragments_give_the_same_template(sierrafile):
+    fragments = {}
+    expected = build(sierrafile)
+    assert build(sierrafile, fragments) == expected
+    assert fragments
+    # Every service comes out of the fragments the second time
+    assert build(sierrafile, fragments) == expected
+
+
+def test_fragments_follow_changes(sierrafile):
+    fragments = {}
+    build(sierrafile, fragments)
+    sierrafile['services']['CaliberZuul']['container']['count'] = 3
+    assert build(sierrafile, fragments) == build(sierrafile)
+
+
+def test_baked_hosts_need_an_image(sierrafile):
+    parameters = build_template(parse(sierrafile)).to_dict()['Parameters']
+    assert 'Default' in parameters['ImageId']
+
+    sierrafile['cluster'] = {'bootstrap': 'baked'}
+    parameters = build_template(parse(sierrafile)).to_dict()['Parameters']
+    assert 'Default' not in parameters['ImageId']
@@ -0,0 +1,108 @@
+import json
+
+import pytest
+
+from sierra.__main__ import main
+from sierra.validate import validate
+
+
+def paths(errors):
+    return [path for path, _ in errors]
+
+
+def test_example_is_valid(sierrafile):
+    assert validate(sierrafile) == []
+
+
+def test_not_an_object():
+    assert validate([]) == [('', 'a Sierrafile must be an object')]
+
+
+def test_reports_every_mistake(sierrafile):
+    services = sierrafile['services']
+    services['CaliberZuul']['container']['port'] = 'http'
+    services['CaliberEureka']['container']['cpu'] = -1
+    del services['CaliberConfig']['container']['image']
+    assert paths(validate(sierrafile)) == [
+        'services.CaliberConfig.container.image',
+        'services.CaliberEureka.container.cpu',
+        'services.CaliberZuul.container.port',
+    ]
+
+
+def test_mistakes_in_defaults_are_reported_once(sierrafile):
+    sierrafile['default']['container']['memory'] = 'lots'
+    assert paths(validate(sierrafile)) == ['default.container.memory']
+
+
+def test_undeclared_environment_variable(sierrafile):
+    sierrafile['services']['CaliberZuul']['environment'] = ['MISSING']
+    assert validate(sierrafile) == [(
+        'services.CaliberZuul.environment[0]',
+        'MISSING is not declared in environment',
+    )]
+
+
+def test_port_taken_twice(sierrafile):
+    services = sierrafile['services']
+    services['CaliberZuul']['container']['port'] = 8888
+    errors = validate(sierrafile)
+    assert len(errors) == 1
+    assert errors[0][0] == 'services.CaliberZuul.container.port'
+
+
+@pytest.mark.parametrize('name', ['a-b', 'Users Service', ''])
+def test_service_names(sierrafile, name):
+    sierrafile['services'][name] = sierrafile['services'].pop('CaliberZuul')
+    assert paths(validate(sierrafile)) == [f'services.{name}']
+
+
+def test_build_cache_location(sierrafile):
+    pipeline = sierrafile['services']['CaliberZuul']['pipeline']
+    pipeline['cache'] = {'type': 's3', 'location': 5}
+    assert paths(validate(sierrafile)) == [
+        'services.CaliberZuul.pipeline.cache.location',
+    ]
+
+
+def test_warm_pool_with_mixed_instances(sierrafile):
+    sierrafile['cluster'] = {
+        'instances': {'types': ['m5.large']},
+        'warm_pool': {},
+    }
+    assert paths(validate(sierrafile)) == ['cluster.warm_pool']
+
+
+def test_log_options(sierrafile):
+    sierrafile['default']['logs'] = {
+        'max_buffer_size': '4m',
+        'retention': 31,
+    }
+    assert paths(validate(sierrafile)) == [
+        'default.logs.max_buffer_size',
+        'default.logs.retention',
+    ]
+
+
+def test_generate_keeps_the_output_on_mistakes(sierrafile, tmp_path, capsys):
+    sierrafile['services']['CaliberZuul']['container']['port'] = 'http'
+    path, out = tmp_path / 'Sierrafile', tmp_path / 'template.yml'
+    path.write_text(json.dumps(sierrafile))
+    out.write_text('the last template')
+
+    with pytest.raises(SystemExit) as exit:
+        main(['-f', str(path), '-o', str(out), '--no-cache'])
+    assert exit.value.code == 1
+    assert out.read_text() == 'the last template'
+    assert capsys.readouterr().err == (
+        f'{path}: services.CaliberZuul.container.port: must be a whole'
+        f' number\n')
+
+
+@pytest.mark.parametrize('key, value', [
+    ('pause', 0), ('pause', 3601),
+    ('signal_timeout', 0), ('signal_timeout', 43201),
+])
+def test_host_deployment_waits(sierrafile, key, value):
+    sierrafile['cluster'] = {'deployment': {key: value}}
+    assert paths(validate(sierrafile)) == [f'cluster.deployment.{key}']